@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.profiling.ProfilingMiddleware',  # First, so profiles include the rest of the middleware stack
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -136,15 +137,28 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '10/minute',
-        'user': '50/minute'
+        'user': '50/minute',
+        # Per-keystroke typeahead lookups (ScopedRateThrottle)
+        'autocomplete': '300/minute',
+        # Product images, one request per thumbnail on a page
+        'product_image': '600/minute',
     },
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend']
 }
 CACHES = {
+    # Shared by every web and Celery process: cart quote versions must be bumped for all of them,
+    # and throttle counts must be global
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'api_cache',
-    }
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/3',
+    },
+    # Write-behind counters (product likes). Shared by web and Celery processes, so it must be a
+    # cross-process backend; entries never expire so pending deltas are not lost before a flush.
+    'counters': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/2',
+        'TIMEOUT': None,
+    },
 }
 
 # Celery settings
@@ -152,5 +166,39 @@ CELERY_BROKER_URL = 'redis://127.0.0.1:6379/1'  # Redis as broker
 # CELERY_ACCEPT_CONTENT = ['json']
 # CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_BACKEND = 'redis://127.0.0.1:6379/1'
+CELERY_BEAT_SCHEDULE = {
+    'flush-product-likes': {
+        'task': 'api.tasks.flush_product_likes',
+        'schedule': 30.0,  # seconds
+    },
+    'purge-idempotency-keys': {
+        'task': 'api.tasks.purge_idempotency_keys',
+        'schedule': 60.0 * 60,
+    },
+    'compute-trending-rankings': {
+        'task': 'api.tasks.compute_trending_rankings',
+        'schedule': 60.0 * 10,
+    },
+    'compute-best-seller-rankings': {
+        'task': 'api.tasks.compute_best_seller_rankings',
+        'schedule': 60.0 * 60,
+    },
+    'update-sales-rollups': {
+        'task': 'api.tasks.update_sales_rollups',
+        'schedule': 60.0 * 5,
+    },
+    'purge-abandoned-carts': {
+        'task': 'api.tasks.purge_abandoned_carts',
+        'schedule': 60.0 * 60 * 6,
+    },
+}
+
+# Carts older than this that never became an order are deleted by api.tasks.purge_abandoned_carts
+ABANDONED_CART_MAX_AGE_DAYS = 30
+
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
-EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
\ No newline at end of file
+# Request profiling: requests with a valid X-Profile-Token header (see `manage.py profile_report --token`)
+# are always profiled; set a sample rate to also profile a random fraction of traffic.
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_DIR = BASE_DIR / 'profiles'
@@ -0,0 +1,243 @@
+from bisect import bisect_right
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .models import Order, CartItem, AppliedVoucher, Price, Voucher, Category, Brand, SalesRollup, SalesRollupState
+from .pricing import voucher_discount
+
+ROLLUP_BATCH_SIZE = 500
+ROLLUP_MAX_BATCHES = 100  # Per run, so a large backfill is spread over several runs
+# Orders newer than this are left for the next run, so a transaction that commits late is not skipped
+ROLLUP_SETTLE_DELAY = timedelta(minutes=5)
+
+# Counts first, then amounts
+ROLLUP_METRICS = ('orders', 'units', 'sales', 'product_discount', 'voucher_discount',
+                  'shipping_fee', 'shipping_discount', 'revenue')
+# Order amounts split across categories and brands; revenue is then derived from the shares
+ALLOCATED_METRICS = ('sales', 'product_discount', 'voucher_discount', 'shipping_fee', 'shipping_discount')
+CENT = Decimal('0.01')
+
+SALES_GROUPINGS = ('day', 'month', SalesRollup.CATEGORY, SalesRollup.BRAND, SalesRollup.VOUCHER)
+
+
+def _price_history(variants):
+    """ {(size_id, color_id): ([created_at, ...], [price, ...])} in ascending order, in one query. """
+    history = {}
+    sizes = {size_id for size_id, _ in variants}
+    colors = {color_id for _, color_id in variants}
+    for size_id, color_id, created_at, price in Price.objects.filter(
+        size_id__in=sizes, color_id__in=colors,
+    ).order_by('created_at', 'id').values_list('size_id', 'color_id', 'created_at', 'price'):
+        times, prices = history.setdefault((size_id, color_id), ([], []))
+        times.append(created_at)
+        prices.append(price)
+    return history
+
+
+def _list_price(history, variant, at):
+    """ The price a variant had at `at`; its oldest price if it was priced later, 0 if never. """
+    times, prices = history.get(variant, ((), ()))
+    if not prices:
+        return Decimal(0)
+    return prices[max(bisect_right(times, at) - 1, 0)]
+
+
+def _split(amount, weights):
+    """ Split `amount` by weight, rounded to cents, with the remainder on the last share so the parts add up. """
+    total_weight = sum(weights.values())
+    keys = list(weights)
+    shares = {}
+    for key in keys[:-1]:
+        shares[key] = (amount * weights[key] / total_weight).quantize(CENT)
+    shares[keys[-1]] = amount - sum(shares.values())
+    return shares
+
+
+def _order_amounts(order):
+    """ Order totals broken into rollup metrics. The voucher part is not stored, so it is recovered from the totals. """
+    voucher_amount = (order.total_price + order.shipping_fee - order.discounted_product
+                      - order.discounted_shipping - order.final_price)
+    return {
+        'sales': order.total_price,
+        # discounted_product also includes the voucher discount
+        'product_discount': order.discounted_product - voucher_amount,
+        'voucher_discount': voucher_amount,
+        'shipping_fee': order.shipping_fee,
+        'shipping_discount': order.discounted_shipping,
+        'revenue': order.final_price,
+    }
+
+
+def _revenue(amounts):
+    """
+    Order.final_price as order creation computes it: total_price is already net of product
+    discounts and discounted_product includes the voucher discount, yet both are subtracted
+    again, so product and voucher discounts each count twice.
+    """
+    return (amounts['sales'] + amounts['shipping_fee'] - amounts['product_discount']
+            - amounts['shipping_discount'] - 2 * amounts['voucher_discount'])
+
+
+def _add(rollups, day, dimension, key, orders=0, units=0, **amounts):
+    row = rollups.setdefault((dimension, key, day), dict.fromkeys(ROLLUP_METRICS, 0))
+    row['orders'] += orders
+    row['units'] += units
+    for metric, amount in amounts.items():
+        row[metric] += amount
+
+
+def rollup_orders(orders):
+    """ Aggregate a batch of orders into {(dimension, key, day): metrics}, with three queries for the whole batch. """
+    items_by_cart = {}
+    for item in CartItem.objects.filter(cart_id__in={order.cart_id for order in orders}).values(
+        'cart_id', 'size_id', 'color_id', 'quantity', 'size__product__category_id', 'size__product__brand_id',
+    ):
+        items_by_cart.setdefault(item['cart_id'], []).append(item)
+    history = _price_history({
+        (item['size_id'], item['color_id']) for items in items_by_cart.values() for item in items
+    })
+    vouchers_by_order = {}
+    for applied in AppliedVoucher.objects.filter(order__in=orders).select_related('voucher'):
+        vouchers_by_order.setdefault(applied.order_id, []).append(applied.voucher)
+
+    rollups = {}
+    for order in orders:
+        day = timezone.localdate(order.created_at)
+        amounts = _order_amounts(order)
+        items = items_by_cart.get(order.cart_id, [])
+        units = sum(item['quantity'] for item in items)
+        _add(rollups, day, SalesRollup.TOTAL, 0, orders=1, units=units, **amounts)
+
+        for dimension, field in ((SalesRollup.CATEGORY, 'size__product__category_id'),
+                                 (SalesRollup.BRAND, 'size__product__brand_id')):
+            values, quantities = {}, {}
+            for item in items:
+                value = _list_price(history, (item['size_id'], item['color_id']), order.created_at) * item['quantity']
+                values[item[field]] = values.get(item[field], 0) + value
+                quantities[item[field]] = quantities.get(item[field], 0) + item['quantity']
+            if not values:
+                continue
+            weights = values if sum(values.values()) else quantities
+            shares = {metric: _split(amounts[metric], weights) for metric in ALLOCATED_METRICS}
+            for key in weights:
+                share = {metric: shares[metric][key] for metric in ALLOCATED_METRICS}
+                # Derived rather than split, so each row's revenue agrees with its own amounts
+                # while the rows still add up to the order's final_price
+                _add(rollups, day, dimension, key, orders=1, units=quantities[key], revenue=_revenue(share), **share)
+
+        vouchers = vouchers_by_order.get(order.id, [])
+        if vouchers:
+            # Weight by what each voucher gives today; fall back to an even split
+            weights = {voucher.id: voucher_discount(voucher, order.total_price) or 0 for voucher in vouchers}
+            if not sum(weights.values()):
+                weights = dict.fromkeys(weights, 1)
+            discounts = _split(amounts['voucher_discount'], weights)
+            for voucher in vouchers:
+                _add(rollups, day, SalesRollup.VOUCHER, voucher.id, orders=1, units=units,
+                     sales=order.total_price, voucher_discount=discounts[voucher.id], revenue=order.final_price)
+    return rollups
+
+
+def _merge(rollups):
+    """ Add batch totals to the stored rows with one read and one upsert. """
+    existing = SalesRollup.objects.filter(
+        dimension__in={dimension for dimension, _, _ in rollups},
+        key__in={key for _, key, _ in rollups},
+        day__in={day for _, _, day in rollups},
+    )
+    for row in existing:
+        batch = rollups.get((row.dimension, row.key, row.day))
+        if batch:
+            for metric in ROLLUP_METRICS:
+                batch[metric] += getattr(row, metric)
+    SalesRollup.objects.bulk_create(
+        [SalesRollup(dimension=dimension, key=key, day=day, **metrics)
+         for (dimension, key, day), metrics in rollups.items()],
+        update_conflicts=True,
+        unique_fields=['dimension', 'key', 'day'],
+        update_fields=list(ROLLUP_METRICS),
+    )
+
+
+def update_sales_rollups(now=None):
+    """
+    Fold orders past the watermark into SalesRollup, ROLLUP_BATCH_SIZE at a time, and return how
+    many were processed. Each batch updates the rollups and the watermark in one transaction, and
+    the watermark row is locked, so overlapping runs neither skip nor double-count orders.
+    """
+    settled_before = (now or timezone.now()) - ROLLUP_SETTLE_DELAY
+    processed = 0
+    for _ in range(ROLLUP_MAX_BATCHES):
+        with transaction.atomic():
+            SalesRollupState.objects.get_or_create(pk=1)
+            state = SalesRollupState.objects.select_for_update().get(pk=1)
+            orders = list(Order.objects.filter(pk__gt=state.last_order_id).order_by('pk')[:ROLLUP_BATCH_SIZE])
+            # Stop at the first unsettled order so ids below the watermark never arrive later
+            settled = next((i for i, order in enumerate(orders) if order.created_at > settled_before), len(orders))
+            orders = orders[:settled]
+            if not orders:
+                break
+            _merge(rollup_orders(orders))
+            state.last_order_id = orders[-1].pk
+            state.save(update_fields=['last_order_id', 'updated_at'])
+        processed += len(orders)
+        if settled < ROLLUP_BATCH_SIZE:
+            break
+    return processed
+
+
+def _totals(queryset):
+    return queryset.annotate(**{f'total_{metric}': Sum(metric) for metric in ROLLUP_METRICS})
+
+
+def _row(values):
+    """ Counts as ints, amounts as decimal strings like DecimalField renders them, so large sums stay exact. """
+    row = {metric: values[f'total_{metric}'] or 0 for metric in ROLLUP_METRICS}
+    for metric in ROLLUP_METRICS[2:]:
+        row[metric] = str(Decimal(row[metric]).quantize(CENT))
+    return row
+
+
+def sales_summary(date_from, date_to, group_by=None):
+    """
+    Sales between two dates (inclusive) from the rollups: overall, or grouped by day, month,
+    category, brand or voucher. Voucher rows overlap when an order used several vouchers.
+    """
+    rows = SalesRollup.objects.filter(day__range=(date_from, date_to))
+    if group_by in (None, 'day', 'month'):
+        rows = rows.filter(dimension=SalesRollup.TOTAL)
+    else:
+        rows = rows.filter(dimension=group_by)
+
+    if group_by is None:
+        totals = rows.aggregate(**{f'total_{metric}': Sum(metric) for metric in ROLLUP_METRICS})
+        return [_row(totals)]
+    if group_by == 'day':
+        return [{'day': values['day'], **_row(values)} for values in _totals(rows.values('day')).order_by('day')]
+    if group_by == 'month':
+        return [
+            {'month': values['month'], **_row(values)}
+            for values in _totals(rows.annotate(month=TruncMonth('day')).values('month')).order_by('month')
+        ]
+
+    results = list(_totals(rows.values('key')).order_by('-total_revenue', 'key'))
+    model, field = {
+        SalesRollup.CATEGORY: (Category, 'category'),
+        SalesRollup.BRAND: (Brand, 'brand'),
+        SalesRollup.VOUCHER: (Voucher, 'description'),
+    }[group_by]
+    names = dict(model.objects.filter(pk__in=[values['key'] for values in results]).values_list('pk', field))
+    return [
+        {f'{group_by}_id': values['key'], 'name': names.get(values['key']), **_row(values)}
+        for values in results
+    ]
+
+
+def rollup_watermark():
+    """ The id of the newest order included in the rollups. """
+    return SalesRollupState.objects.filter(pk=1).values_list('last_order_id', flat=True).first() or 0
@@ -0,0 +1,423 @@
+import heapq
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.core.cache import caches
+from django.db import connections
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+AUTOCOMPLETE_LIMIT = 10
+# Prefixes matching more keys than this keep a precomputed top list; others scan their key range
+SCAN_LIMIT = 256
+PRECOMPUTED_TOP_SIZE = 50
+# How often a process looks for product changes published by other processes
+SYNC_INTERVAL = 1.0
+# How long a request waits for the first build before answering with no suggestions
+FIRST_BUILD_WAIT = 0.2
+# More pending changes than this and rebuilding is cheaper than replaying them
+MAX_REPLAYED_CHANGES = 10000
+
+CHANGE_SEQ_KEY = 'autocomplete_change_seq'
+CHANGE_SLOT_KEY = 'autocomplete_change:{}'
+CHANGE_SLOT_TIMEOUT = 60 * 60 * 24
+REBUILD_SEQ_KEY = 'autocomplete_rebuild_seq'
+
+MODEL, BRAND, CATEGORY = 'model', 'brand', 'category'
+KINDS = (MODEL, BRAND, CATEGORY)
+
+# A key packs an entry id and the offset of a word start in its name; names are at most 255 characters
+KEY_STRIDE = 256
+PREFIX_END = '\U0010ffff'
+NO_ENTRY = -1
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().split())
+
+
+def _word_starts(name):
+    starts = [0]
+    space = name.find(' ')
+    while 0 <= space < KEY_STRIDE - 1:
+        starts.append(space + 1)
+        space = name.find(' ', space + 1)
+    return starts
+
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index over product model, brand and category names.
+
+    Every distinct (kind, name) is one entry, scored by the total like_count of the products
+    using it. Each word start of a name (so "runner" finds "Nike Runner") is one key, an int
+    packing the entry id and the offset, and the key array is sorted by the name from that offset
+    on, so a prefix lookup is two bisects. Prefixes matching more than SCAN_LIMIT keys keep a
+    precomputed top list, built from those of their one character longer children; the rest scan
+    their short key range.
+    """
+    def __init__(self):
+        self._keys = array('q')   # entry id * KEY_STRIDE + word offset, sorted by the name from that offset
+        self._names = []          # entry id -> normalized name, None once removed
+        self._texts = []          # entry id -> name as displayed
+        self._kinds = bytearray() # entry id -> index into KINDS
+        self._scores = array('q') # entry id -> total like_count of its products
+        self._counts = array('l') # entry id -> number of products using it
+        self._entry_ids = ({}, {}, {})       # per kind: normalized name -> entry id
+        self._product_entries = array('l')   # product id * 3 + kind -> entry id or NO_ENTRY
+        self._product_likes = array('q')     # product id -> like_count
+        # Precomputed top lists, by prefix. None marks a list dropped by an update, to be recomputed.
+        # Every prefix of a key is a key too, so updates can stop at the first prefix without a list.
+        self._top = {}
+        self._stale = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entry_ids[0]) + len(self._entry_ids[1]) + len(self._entry_ids[2])
+
+    def _suffix(self, key):
+        entry_id, offset = divmod(key, KEY_STRIDE)
+        return self._names[entry_id][offset:]
+
+    def _range(self, prefix):
+        return (bisect_left(self._keys, prefix, key=self._suffix),
+                bisect_left(self._keys, prefix + PREFIX_END, key=self._suffix))
+
+    def _rank_key(self, entry_id):
+        return -self._scores[entry_id], entry_id
+
+    def _add_entry(self, kind, text, name):
+        entry_id = self._entry_ids[kind][name] = len(self._names)
+        self._names.append(name)
+        self._texts.append(text)
+        self._kinds.append(kind)
+        self._scores.append(0)
+        self._counts.append(0)
+        return entry_id
+
+    def _entry_id(self, kind, text, name):
+        entry_id = self._entry_ids[kind].get(name)
+        if entry_id is None:
+            entry_id = self._add_entry(kind, text, name)
+            for offset in _word_starts(name):
+                self._keys.insert(bisect_right(self._keys, name[offset:], key=self._suffix),
+                                  entry_id * KEY_STRIDE + offset)
+        return entry_id
+
+    def _remove_entry(self, entry_id):
+        name = self._names[entry_id]
+        del self._entry_ids[self._kinds[entry_id]][name]
+        for offset in _word_starts(name):
+            lo = bisect_left(self._keys, name[offset:], key=self._suffix)
+            hi = bisect_right(self._keys, name[offset:], lo, key=self._suffix)
+            del self._keys[self._keys.index(entry_id * KEY_STRIDE + offset, lo, hi)]
+        self._names[entry_id] = self._texts[entry_id] = None
+
+    def _listed_prefixes(self, name):
+        """ The prefixes of the name's word starts that have a top list. """
+        prefixes = set()
+        for offset in _word_starts(name):
+            for end in range(offset + 1, len(name) + 1):
+                prefix = name[offset:end]
+                if prefix not in self._top:
+                    break
+                prefixes.add(prefix)
+        return prefixes
+
+    def _drop_top(self, prefix):
+        self._top[prefix] = None
+        self._stale.add(prefix)
+
+    def _update_top(self, entry_id, name, increased, removed=False):
+        """
+        Keep the precomputed top lists in step with one entry's score. Increases (likes, new
+        products) are merged in place; a drop of an entry that may have a replacement outside the
+        list discards the list so it is recomputed.
+        """
+        for prefix in self._listed_prefixes(name):
+            top = self._top[prefix]
+            if top is None:
+                continue
+            # A short list holds every entry under the prefix, so it can always be fixed in place
+            complete = len(top) < PRECOMPUTED_TOP_SIZE
+            if removed:
+                if entry_id not in top:
+                    continue
+                if complete:
+                    top.remove(entry_id)
+                else:
+                    self._drop_top(prefix)
+            elif increased:
+                if entry_id not in top:
+                    if not complete and self._rank_key(entry_id) > self._rank_key(top[-1]):
+                        continue
+                    top.append(entry_id)
+                top.sort(key=self._rank_key)
+                del top[PRECOMPUTED_TOP_SIZE:]
+            elif entry_id in top:
+                if complete:
+                    top.sort(key=self._rank_key)
+                else:
+                    self._drop_top(prefix)
+
+    def _adjust(self, entry_id, like_delta, product_delta):
+        self._scores[entry_id] += like_delta
+        self._counts[entry_id] += product_delta
+        name = self._names[entry_id]
+        if self._counts[entry_id] <= 0:
+            self._remove_entry(entry_id)
+            self._update_top(entry_id, name, increased=False, removed=True)
+        elif like_delta or self._counts[entry_id] == product_delta:
+            self._update_top(entry_id, name, increased=like_delta >= 0)
+
+    def _grow_products(self, product_id):
+        if len(self._product_likes) <= product_id:
+            grow = max(product_id + 1, 2 * len(self._product_likes)) - len(self._product_likes)
+            self._product_entries.extend(array('l', [NO_ENTRY]) * (3 * grow))
+            self._product_likes.extend(array('q', [0]) * grow)
+
+    def _put(self, product_id, model, brand, category, like_count):
+        entry_ids = []
+        for kind, text in enumerate((model, brand, category)):
+            name = normalize(text)
+            entry_ids.append(self._entry_id(kind, text, name) if name else NO_ENTRY)
+        self._grow_products(product_id)
+        slots = slice(3 * product_id, 3 * product_id + 3)
+        # Net out the old and new contribution so an unchanged name is adjusted once, not removed and re-added
+        deltas = {entry_id: [like_count, 1] for entry_id in entry_ids if entry_id != NO_ENTRY}
+        previous_likes = self._product_likes[product_id]
+        for entry_id in self._product_entries[slots]:
+            if entry_id != NO_ENTRY:
+                delta = deltas.setdefault(entry_id, [0, 0])
+                delta[0] -= previous_likes
+                delta[1] -= 1
+        self._product_entries[slots] = array('l', entry_ids)
+        self._product_likes[product_id] = like_count
+        for entry_id, (like_delta, product_delta) in deltas.items():
+            if like_delta or product_delta:
+                self._adjust(entry_id, like_delta, product_delta)
+
+    def _drop(self, product_id):
+        if product_id >= len(self._product_likes):
+            return
+        slots = slice(3 * product_id, 3 * product_id + 3)
+        like_count = self._product_likes[product_id]
+        for entry_id in self._product_entries[slots]:
+            if entry_id != NO_ENTRY:
+                self._adjust(entry_id, -like_count, -1)
+        self._product_entries[slots] = array('l', [NO_ENTRY] * 3)
+        self._product_likes[product_id] = 0
+
+    def _children(self, prefix, lo, hi):
+        """ Split a prefix's key range into runs by the character after it, '' for the prefix itself. """
+        depth = len(prefix)
+        while lo < hi:
+            suffix = self._suffix(self._keys[lo])
+            if len(suffix) == depth:
+                char, end = '', bisect_right(self._keys, prefix, lo, hi, key=self._suffix)
+            else:
+                char = suffix[depth]
+                end = bisect_left(self._keys, prefix + char + PREFIX_END, lo, hi, key=self._suffix)
+            yield char, lo, end
+            lo = end
+
+    def _fill_top(self, prefix, lo, hi):
+        """
+        Compute the top list of a prefix with more than SCAN_LIMIT keys from its children: the lists
+        of those that are that large too (computed first when missing), the keys of the others.
+        """
+        candidates = set()
+        for char, child_lo, child_hi in self._children(prefix, lo, hi):
+            if char and child_hi - child_lo > SCAN_LIMIT:
+                top = self._top.get(prefix + char)
+                if top is None:
+                    top = self._fill_top(prefix + char, child_lo, child_hi)
+                candidates.update(top)
+            else:
+                candidates.update(key // KEY_STRIDE for key in self._keys[child_lo:child_hi])
+        top = self._top[prefix] = heapq.nsmallest(PRECOMPUTED_TOP_SIZE, candidates, key=self._rank_key)
+        self._stale.discard(prefix)
+        return top
+
+    def _top_list(self, prefix):
+        """ The top list of a prefix with more than SCAN_LIMIT keys, computing it if dropped or new. """
+        top = self._top.get(prefix)
+        if top is None:
+            # Start from the shortest prefix without a list so every prefix of a listed one stays listed
+            missing = next((prefix[:end] for end in range(1, len(prefix)) if prefix[:end] not in self._top), prefix)
+            self._fill_top(missing, *self._range(missing))
+            top = self._top[prefix]
+        return top
+
+    def _refresh_stale(self):
+        for prefix in sorted(self._stale, key=len):
+            if self._top.get(prefix) is None:
+                self._fill_top(prefix, *self._range(prefix))
+        self._stale.clear()
+
+    def load(self, rows):
+        """ Bulk-load (product id, model, brand, category, like_count) rows into an empty index. """
+        with self._lock:
+            keys = []
+            names = {}  # Brands and categories repeat across products; normalize each text once
+            for product_id, model, brand, category, like_count in rows:
+                self._grow_products(product_id)
+                for kind, text in enumerate((model, brand, category)):
+                    name = names.get(text) if kind else None
+                    if name is None:
+                        name = normalize(text)
+                        if kind:
+                            names[text] = name
+                    if not name:
+                        continue
+                    entry_id = self._entry_ids[kind].get(name)
+                    if entry_id is None:
+                        entry_id = self._add_entry(kind, text, name)
+                        keys.extend(entry_id * KEY_STRIDE + offset for offset in _word_starts(name))
+                    self._scores[entry_id] += like_count
+                    self._counts[entry_id] += 1
+                    self._product_entries[3 * product_id + kind] = entry_id
+                self._product_likes[product_id] = like_count
+            keys.sort(key=self._suffix)
+            self._keys = array('q', keys)
+            self._top.clear()
+            for char, lo, hi in self._children('', 0, len(self._keys)):
+                if hi - lo > SCAN_LIMIT:
+                    self._fill_top(char, lo, hi)
+
+    def apply(self, rows, removed_ids=()):
+        """ Upsert changed product rows and drop removed products, then recompute dropped top lists. """
+        with self._lock:
+            for product_id in removed_ids:
+                self._drop(product_id)
+            for row in rows:
+                self._put(*row)
+            self._refresh_stale()
+
+    def search(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """ Best-liked names with a word starting with `prefix`, as (text, kind, score) tuples. """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            top = self._top.get(prefix) if limit <= PRECOMPUTED_TOP_SIZE else None
+            if top is None:
+                lo, hi = self._range(prefix)
+                if hi - lo > SCAN_LIMIT and limit <= PRECOMPUTED_TOP_SIZE:
+                    top = self._top_list(prefix)
+                else:
+                    top = heapq.nsmallest(limit, {key // KEY_STRIDE for key in self._keys[lo:hi]},
+                                          key=self._rank_key)
+            entry_ids = top[:limit]
+            return [(self._texts[entry_id], KINDS[self._kinds[entry_id]], self._scores[entry_id])
+                    for entry_id in entry_ids]
+
+
+def _product_rows(queryset):
+    return queryset.values_list('pk', 'model', 'brand__brand', 'category__category', 'like_count')
+
+
+def _changes_cache():
+    return caches['counters']
+
+
+def publish_product_changes(product_ids):
+    """ Record changed or deleted products so every process's index picks them up. """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    cache = _changes_cache()
+    cache.add(CHANGE_SEQ_KEY, 0, timeout=None)
+    # Reserve a block of sequence numbers in one incr, then fill the slots in one round trip
+    first_seq = cache.incr(CHANGE_SEQ_KEY, len(product_ids)) - len(product_ids) + 1
+    cache.set_many(
+        {CHANGE_SLOT_KEY.format(first_seq + i): product_id for i, product_id in enumerate(product_ids)},
+        timeout=CHANGE_SLOT_TIMEOUT,
+    )
+
+
+def publish_rebuild():
+    """ Brand or category renames touch many products at once; ask every process to rebuild. """
+    cache = _changes_cache()
+    cache.add(REBUILD_SEQ_KEY, 0, timeout=None)
+    cache.incr(REBUILD_SEQ_KEY)
+
+
+class _IndexHolder:
+    def __init__(self):
+        self.index = None
+        self.change_seq = 0
+        self.rebuild_seq = 0
+        self.checked_at = 0.0
+        self.lock = threading.Lock()  # Held by the background thread building or syncing the index
+        self.built = threading.Event()
+
+    def _build(self):
+        cache = _changes_cache()
+        # Read the sequences first so changes made during the load are replayed afterwards
+        self.change_seq = cache.get(CHANGE_SEQ_KEY, 0)
+        self.rebuild_seq = cache.get(REBUILD_SEQ_KEY, 0)
+        index = PrefixIndex()
+        index.load(_product_rows(Product.objects.all()).iterator(chunk_size=5000))
+        # Requests keep using the previous index until the new one is complete
+        self.index = index
+        self.built.set()
+
+    def _sync(self):
+        cache = _changes_cache()
+        change_seq = cache.get(CHANGE_SEQ_KEY, 0)
+        if cache.get(REBUILD_SEQ_KEY, 0) != self.rebuild_seq or change_seq - self.change_seq > MAX_REPLAYED_CHANGES:
+            self._build()
+            return
+        if change_seq <= self.change_seq:
+            return
+        slot_keys = [CHANGE_SLOT_KEY.format(seq) for seq in range(self.change_seq + 1, change_seq + 1)]
+        slots = cache.get_many(slot_keys)
+        if len(slots) != len(slot_keys):
+            self._build()  # Slots expired or were evicted; we cannot tell what changed
+            return
+        product_ids = set(slots.values())
+        rows = list(_product_rows(Product.objects.filter(pk__in=product_ids)))
+        self.index.apply(rows, removed_ids=product_ids - {row[0] for row in rows})
+        self.change_seq = change_seq
+
+    def _refresh(self):
+        try:
+            if self.index is None:
+                self._build()
+            else:
+                self._sync()
+        except Exception:
+            logger.exception("Could not refresh the autocomplete index")
+        finally:
+            # This thread's database connection would otherwise stay open
+            connections.close_all()
+            self.lock.release()
+
+    def get(self):
+        """
+        The process-wide index, or None while its first build is still running. Building and
+        syncing (at most once per SYNC_INTERVAL) run in a background thread, so a request never
+        waits on them for longer than FIRST_BUILD_WAIT.
+        """
+        now = time.monotonic()
+        if now - self.checked_at >= SYNC_INTERVAL and self.lock.acquire(blocking=False):
+            self.checked_at = now
+            threading.Thread(target=self._refresh, name='autocomplete-index', daemon=True).start()
+        if self.index is None:
+            self.built.wait(FIRST_BUILD_WAIT)
+        return self.index
+
+
+_holder = _IndexHolder()
+
+
+def autocomplete(prefix, limit=AUTOCOMPLETE_LIMIT):
+    """ Suggestions for a prefix; none until this process has built its index. """
+    index = _holder.get()
+    return index.search(prefix, limit) if index is not None else []
@@ -0,0 +1,79 @@
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import Category, Product
+
+PRODUCT_COUNT_KEY = 'category_count:{}:products'
+IN_STOCK_COUNT_KEY = 'category_count:{}:in_stock'
+
+
+def _count_cache():
+    # Adjusted by deltas from every web and Celery process, so it must be the shared 'counters' cache
+    return caches['counters']
+
+
+def _count_keys(category_id):
+    return PRODUCT_COUNT_KEY.format(category_id), IN_STOCK_COUNT_KEY.format(category_id)
+
+
+def _store_counts(queryset):
+    """ Count products and in-stock products per category in one grouped query and cache the result. """
+    counts = {}
+    values = {}
+    for category_id, product_count, in_stock_count in queryset.annotate(
+        product_count=Count('product'),
+        in_stock_count=Count('product', filter=Q(product__availability__quantity__gt=0)),
+    ).values_list('id', 'product_count', 'in_stock_count'):
+        counts[category_id] = {'product_count': product_count, 'in_stock_count': in_stock_count}
+        products_key, in_stock_key = _count_keys(category_id)
+        values[products_key] = product_count
+        values[in_stock_key] = in_stock_count
+    _count_cache().set_many(values, timeout=None)
+    return counts
+
+
+def category_counts(category_ids):
+    """
+    Product and in-stock product counts for the given categories. Served from the cache and only
+    recomputed, for every category at once, when an entry is missing.
+    """
+    keys = {category_id: _count_keys(category_id) for category_id in category_ids}
+    cached = _count_cache().get_many([key for pair in keys.values() for key in pair])
+    if all(key in cached for pair in keys.values() for key in pair):
+        return {
+            category_id: {'product_count': cached[products_key], 'in_stock_count': cached[in_stock_key]}
+            for category_id, (products_key, in_stock_key) in keys.items()
+        }
+    counts = _store_counts(Category.objects.all())
+    return {category_id: counts.get(category_id, {'product_count': 0, 'in_stock_count': 0})
+            for category_id in category_ids}
+
+
+def _adjust(key, delta):
+    if not delta:
+        return
+    try:
+        _count_cache().incr(key, delta)
+    except ValueError:
+        pass  # Not cached yet; the next read recomputes it
+
+
+def adjust_category_counts(category_id, products=0, in_stock=0):
+    """ Apply count deltas to one category once the surrounding transaction commits. """
+    products_key, in_stock_key = _count_keys(category_id)
+
+    def apply():
+        _adjust(products_key, products)
+        _adjust(in_stock_key, in_stock)
+
+    transaction.on_commit(apply)
+
+
+def recount_category(category_id):
+    """ Recount one category exactly; used after deletes, where cascades make deltas unreliable. """
+    transaction.on_commit(lambda: _store_counts(Category.objects.filter(pk=category_id)))
+
+
+def product_in_stock(product_id):
+    return Product.objects.filter(pk=product_id, availability__quantity__gt=0).exists()
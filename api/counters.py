@@ -0,0 +1,152 @@
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .autocomplete import publish_product_changes
+from .models import Product, ProductLikeActivity
+
+# Must be a backend shared by web and Celery processes (Redis in settings), where add/incr are atomic.
+COUNTER_CACHE_ALIAS = 'counters'
+
+LIKE_DELTA_KEY = 'product_like_delta:{}'
+LIKE_PENDING_KEY = 'product_like_pending:{}'
+LIKE_SLOT_KEY = 'product_like_slot:{}'
+LIKE_SLOT_SEQ_KEY = 'product_like_slot_seq'
+LIKE_SLOT_GAP_KEY = 'product_like_slot_gap'
+LIKE_FLUSHED_SEQ_KEY = 'product_like_flushed_seq'
+# A slot is written right after its number is reserved, so one still empty this long after a flush
+# first found it empty belongs to a writer that died in between
+LIKE_SLOT_GAP_GRACE = 60
+# The pending flag of a product whose slot was lost expires, so its next like registers it again
+LIKE_PENDING_TIMEOUT = 60 * 60
+LIKE_FLUSH_LOCK_KEY = 'product_like_flush_lock'
+LIKE_FLUSH_LOCK_TIMEOUT = 60 * 5
+
+
+def _counter_cache():
+    return caches[COUNTER_CACHE_ALIAS]
+
+
+def _incr(cache, key, delta):
+    cache.add(key, 0, timeout=None)
+    return cache.incr(key, delta)
+
+
+def _register_dirty(cache, product_id):
+    if cache.add(LIKE_PENDING_KEY.format(product_id), 1, timeout=LIKE_PENDING_TIMEOUT):
+        cache.set(LIKE_SLOT_KEY.format(_incr(cache, LIKE_SLOT_SEQ_KEY, 1)), product_id, timeout=None)
+
+
+def add_product_like(product_id, delta=1):
+    """
+    Buffer a like (delta=1) or unlike (delta=-1) for a product and return its pending delta.
+    The first change since the last flush also records the product id in the next dirty slot.
+    """
+    cache = _counter_cache()
+    pending = _incr(cache, LIKE_DELTA_KEY.format(product_id), delta)
+    _register_dirty(cache, product_id)
+    return pending
+
+
+def pending_like_deltas(product_ids):
+    """ Unflushed like deltas for the given products, in one cache round trip. """
+    keys = {LIKE_DELTA_KEY.format(product_id): product_id for product_id in product_ids}
+    return {keys[key]: delta for key, delta in _counter_cache().get_many(keys).items() if delta}
+
+
+def _record_like_activity(by_delta):
+    """ Add flushed deltas to today's ProductLikeActivity rows, which feed trending rankings. """
+    today = timezone.localdate()
+    # Likes buffered for a product that has since been deleted are dropped
+    existing = set(Product.objects.filter(
+        pk__in=[product_id for ids in by_delta.values() for product_id in ids]
+    ).values_list('pk', flat=True))
+    ProductLikeActivity.objects.bulk_create(
+        [ProductLikeActivity(product_id=product_id, day=today) for product_id in existing],
+        ignore_conflicts=True,
+    )
+    for delta, ids in by_delta.items():
+        ProductLikeActivity.objects.filter(product_id__in=ids, day=today).update(likes=F('likes') + delta)
+
+
+def _slot_abandoned(cache, seq):
+    """ Whether the empty slot `seq` has stayed empty for LIKE_SLOT_GAP_GRACE since a flush first saw it. """
+    now = time.time()
+    gap = cache.get(LIKE_SLOT_GAP_KEY)
+    if gap is None or gap[0] != seq:
+        cache.set(LIKE_SLOT_GAP_KEY, (seq, now), timeout=None)
+        return False
+    return now - gap[1] >= LIKE_SLOT_GAP_GRACE
+
+
+def _ready_slots(cache, flushed_seq, slot_seq):
+    """
+    Read the slots after flushed_seq, stopping at the first one whose number is reserved but whose
+    product id is not written yet. Returns the last slot read and the product ids found.
+    """
+    slot_keys = [LIKE_SLOT_KEY.format(seq) for seq in range(flushed_seq + 1, slot_seq + 1)]
+    slots = cache.get_many(slot_keys)
+    product_ids = set()
+    ready_seq = flushed_seq
+    for key in slot_keys:
+        if key in slots:
+            product_ids.add(slots[key])
+        elif not _slot_abandoned(cache, ready_seq + 1):
+            break
+        ready_seq += 1
+    return ready_seq, product_ids
+
+
+def flush_product_likes():
+    """
+    Apply buffered like deltas to Product.like_count and return the number of products updated.
+
+    Each product's pending flag is cleared before its delta is read, so a like arriving mid-flush
+    re-registers the product for the next run. Slots are consumed in order up to the first one
+    still being written, so a product registered mid-flush is never skipped. Deltas are only
+    subtracted from the cache after the database write commits, and with a compensating incr()
+    rather than a delete, so increments racing with the flush are never lost.
+    """
+    cache = _counter_cache()
+    if not cache.add(LIKE_FLUSH_LOCK_KEY, 1, timeout=LIKE_FLUSH_LOCK_TIMEOUT):
+        return 0
+    try:
+        flushed_seq = cache.get(LIKE_FLUSHED_SEQ_KEY, 0)
+        slot_seq = cache.get(LIKE_SLOT_SEQ_KEY, 0)
+        if slot_seq <= flushed_seq:
+            return 0
+
+        ready_seq, product_ids = _ready_slots(cache, flushed_seq, slot_seq)
+        if ready_seq == flushed_seq:
+            return 0
+        cache.delete_many([LIKE_PENDING_KEY.format(product_id) for product_id in product_ids])
+
+        deltas = pending_like_deltas(product_ids)
+        by_delta = {}
+        for product_id, delta in deltas.items():
+            by_delta.setdefault(delta, []).append(product_id)
+
+        try:
+            # One UPDATE per distinct delta value; during a spike most products share a handful of deltas
+            with transaction.atomic():
+                for delta, ids in by_delta.items():
+                    # Unlikes racing past the view's check must not take the count below zero
+                    Product.objects.filter(pk__in=ids).update(like_count=Greatest(F('like_count') + delta, 0))
+                _record_like_activity(by_delta)
+        except Exception:
+            for product_id in product_ids:
+                _register_dirty(cache, product_id)
+            raise
+
+        for product_id, delta in deltas.items():
+            cache.incr(LIKE_DELTA_KEY.format(product_id), -delta)
+        publish_product_changes(deltas)
+        cache.delete_many([LIKE_SLOT_KEY.format(seq) for seq in range(flushed_seq + 1, ready_seq + 1)])
+        cache.set(LIKE_FLUSHED_SEQ_KEY, ready_seq, timeout=None)
+        return len(deltas)
+    finally:
+        cache.delete(LIKE_FLUSH_LOCK_KEY)
@@ -0,0 +1,78 @@
+import csv
+import json
+
+from .models import Order
+
+ORDER_EXPORT_FORMATS = ('csv', 'ndjson')
+ORDER_EXPORT_CHUNK_SIZE = 2000
+
+ORDER_EXPORT_FIELDS = [
+    'order_id', 'created_at', 'user_id', 'username', 'email', 'cart_id',
+    'payment_method', 'shipping_type', 'is_company_order',
+    'total_price', 'shipping_fee', 'discounted_product', 'discounted_shipping', 'final_price',
+    'voucher_ids',
+]
+
+
+class Echo:
+    """ File-like object whose write() hands the line back instead of buffering it. """
+    def write(self, value):
+        return value
+
+
+def order_export_queryset(created_at_min=None, created_at_max=None):
+    queryset = Order.objects.select_related('cart__user').prefetch_related('appliedvoucher_set')
+    if created_at_min:
+        queryset = queryset.filter(created_at__gte=created_at_min)
+    if created_at_max:
+        queryset = queryset.filter(created_at__lte=created_at_max)
+    return queryset.order_by('created_at', 'id')
+
+
+def iter_order_rows(queryset, chunk_size=ORDER_EXPORT_CHUNK_SIZE):
+    """
+    Yield one flat dict per order. The queryset is walked with a server-side cursor and
+    applied vouchers are prefetched per chunk, so memory stays bounded by chunk_size.
+    """
+    for order in queryset.iterator(chunk_size=chunk_size):
+        user = order.cart.user
+        yield {
+            'order_id': order.id,
+            'created_at': order.created_at.isoformat(),
+            'user_id': user.id,
+            'username': user.username,
+            'email': user.email,
+            'cart_id': order.cart_id,
+            'payment_method': order.payment_method,
+            'shipping_type': order.shipping_type,
+            'is_company_order': order.is_company_order,
+            'total_price': str(order.total_price),
+            'shipping_fee': str(order.shipping_fee),
+            'discounted_product': str(order.discounted_product),
+            'discounted_shipping': str(order.discounted_shipping),
+            'final_price': str(order.final_price),
+            'voucher_ids': [applied.voucher_id for applied in order.appliedvoucher_set.all()],
+        }
+
+
+def render_csv(rows):
+    writer = csv.DictWriter(Echo(), fieldnames=ORDER_EXPORT_FIELDS)
+    yield writer.writeheader()
+    for row in rows:
+        row['voucher_ids'] = ';'.join(str(voucher_id) for voucher_id in row['voucher_ids'])
+        yield writer.writerow(row)
+
+
+def render_ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+def export_orders(export_format, created_at_min=None, created_at_max=None, chunk_size=ORDER_EXPORT_CHUNK_SIZE):
+    """ Return a lazy iterator of text chunks for the requested format. """
+    if export_format not in ORDER_EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    rows = iter_order_rows(order_export_queryset(created_at_min, created_at_max), chunk_size)
+    if export_format == 'csv':
+        return render_csv(rows)
+    return render_ndjson(rows)
@@ -1,7 +1,7 @@
 import django_filters
 from django.db.models import OuterRef, Subquery, Q, Min, DateTimeField
 from django_filters.rest_framework import OrderingFilter
-from .models import Product, Price
+from .models import Product, Price, CurrentPrice
 
 
 class ProductFilter(django_filters.FilterSet):
@@ -15,6 +15,7 @@ class ProductFilter(django_filters.FilterSet):
     price_max = django_filters.NumberFilter(method='filter_price_max')
     created_at_min = django_filters.DateTimeFilter(method='filter_created_at_min')
     created_at_max = django_filters.DateTimeFilter(method='filter_created_at_max')
+    in_stock = django_filters.BooleanFilter(method='filter_in_stock')
 
     ordering = OrderingFilter(
         fields=[
@@ -31,6 +32,7 @@ class ProductFilter(django_filters.FilterSet):
             'brand', 'category',
             'price_min', 'price_max',
             'created_at_min', 'created_at_max',
+            'in_stock',
         ]
 
     def _price_created_at_subquery(self):
@@ -41,10 +43,11 @@ class ProductFilter(django_filters.FilterSet):
         ).values('created')[:1]
 
     def _price_min_subquery(self):
-        return Price.objects.filter(
+        # Lowest current price among the product's variants, not the lowest price ever recorded
+        return CurrentPrice.objects.filter(
             Q(size__product=OuterRef('pk')) & Q(color__product=OuterRef('pk'))
         ).values('size__product').annotate(
-            min_price=Min('price')
+            min_price=Min('price__price')
         ).values('min_price')[:1]
 
     def filter_created_at_min(self, queryset, name, value):
@@ -64,3 +67,7 @@ class ProductFilter(django_filters.FilterSet):
     def filter_price_max(self, queryset, name, value):
         subquery = self._price_min_subquery()
         return queryset.annotate(min_price=Subquery(subquery)).filter(min_price__lte=value)
+
+    def filter_in_stock(self, queryset, name, value):
+        in_stock = Q(availability__quantity__gt=0)
+        return queryset.filter(in_stock) if value else queryset.exclude(in_stock)
@@ -0,0 +1,105 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+# A claim without a stored response older than this is treated as abandoned by a crashed worker
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(minutes=1)
+IDEMPOTENCY_PURGE_BATCH_SIZE = 1000
+
+
+def request_fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{request.method} {request.path} {payload}".encode()).hexdigest()
+
+
+def _claim(key, fingerprint):
+    """ Return (record, owned). owned is True when the caller must execute the request. """
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(key=key, fingerprint=fingerprint, locked_at=now), True
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.filter(key=key).first()
+    if record is None:
+        return _claim(key, fingerprint)  # Purged between our insert and lookup
+    if record.created_at < now - IDEMPOTENCY_KEY_TTL:
+        IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+        return _claim(key, fingerprint)
+    if record.status_code is None and record.locked_at < now - IDEMPOTENCY_LOCK_TIMEOUT:
+        # Take over an abandoned claim; the conditional update lets only one retry win
+        taken = IdempotencyKey.objects.filter(pk=record.pk, locked_at=record.locked_at, status_code__isnull=True) \
+            .update(locked_at=now, fingerprint=fingerprint)
+        if taken:
+            record.locked_at = now
+            record.fingerprint = fingerprint
+            return record, True
+        record.refresh_from_db()
+    return record, False
+
+
+def idempotent(handler):
+    """
+    Decorate an APIView method so requests carrying an Idempotency-Key header run at most once.
+    The first request's response is stored and replayed to later duplicates; duplicates that
+    arrive while it is still running get 409, and reusing a key with a different body gets 422.
+    Requests without the header run normally.
+    """
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return handler(view, request, *args, **kwargs)
+
+        fingerprint = request_fingerprint(request)
+        record, owned = _claim(key, fingerprint)
+        if not owned:
+            if record.fingerprint != fingerprint:
+                return Response({"error": f"{IDEMPOTENCY_HEADER} was already used for a different request."},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if record.status_code is None:
+                return Response({"error": "A request with this Idempotency-Key is still being processed."},
+                                status=status.HTTP_409_CONFLICT)
+            response = Response(record.response_body, status=record.status_code)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        try:
+            response = handler(view, request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.objects.filter(pk=record.pk).delete()
+            raise
+        if response.status_code >= 500:
+            # Server errors are not final; let the client retry with the same key
+            IdempotencyKey.objects.filter(pk=record.pk).delete()
+        else:
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                status_code=response.status_code,
+                response_body=response.data,
+            )
+        return response
+
+    return wrapper
+
+
+def purge_idempotency_keys(now=None):
+    """ Delete expired keys in small batches to keep write locks short. Returns the number deleted. """
+    cutoff = (now or timezone.now()) - IDEMPOTENCY_KEY_TTL
+    deleted = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(created_at__lt=cutoff)
+                   .values_list('pk', flat=True)[:IDEMPOTENCY_PURGE_BATCH_SIZE])
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
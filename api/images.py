@@ -0,0 +1,104 @@
+import hashlib
+from io import BytesIO
+
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from .models import Product, ProductImageVariant
+
+IMAGE_VARIANT_WIDTHS = (160, 320, 640, 1280)
+# (Pillow format, content type, save options)
+IMAGE_VARIANT_FORMATS = (
+    ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+IMAGE_VERSION_LENGTH = 16
+# What Pillow raises for data it cannot or will not decode; DecompressionBombError is not an OSError
+IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+
+def image_digest(data):
+    return hashlib.sha256(bytes(data)).hexdigest()
+
+
+def render_variants(data):
+    """
+    Resize and recompress one source image into every configured width and format.
+    Pure Pillow work with no database access, so it is safe to run in a worker process.
+    Returns a list of (width, format, content_type, bytes); images are never upscaled.
+    """
+    with Image.open(BytesIO(bytes(data))) as source:
+        image = ImageOps.exif_transpose(source)
+        image = image.convert('RGB')
+
+    variants = []
+    for width in sorted({min(width, image.width) for width in IMAGE_VARIANT_WIDTHS}):
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+        for image_format, content_type, options in IMAGE_VARIANT_FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, image_format, **options)
+            variants.append((width, image_format, content_type, buffer.getvalue()))
+    return variants
+
+
+def store_variants(product_id, digest, variants):
+    """ Replace a product's variants with freshly rendered ones. """
+    with transaction.atomic():
+        ProductImageVariant.objects.filter(product_id=product_id).delete()
+        ProductImageVariant.objects.bulk_create(
+            ProductImageVariant(product_id=product_id, width=width, format=image_format,
+                                content_type=content_type, data=data, source_digest=digest)
+            for width, image_format, content_type, data in variants
+        )
+
+
+def generate_variants(product_id, force=False):
+    """ Render and store variants for one product unless they already match its current image. """
+    data = Product.objects.filter(pk=product_id).values_list('product_image', flat=True).first()
+    if not data:
+        ProductImageVariant.objects.filter(product_id=product_id).delete()
+        return 0
+    digest = image_digest(data)
+    if not force and ProductImageVariant.objects.filter(product_id=product_id, source_digest=digest).exists():
+        return 0
+    variants = render_variants(data)
+    store_variants(product_id, digest, variants)
+    return len(variants)
+
+
+def image_versions(product_ids):
+    """
+    {product_id: version} for the products that have an image, without loading any image data.
+    The version is a prefix of the digest the variants were rendered from, or '' until they exist.
+    """
+    versions = dict.fromkeys(
+        Product.objects.filter(pk__in=product_ids, product_image__isnull=False).values_list('pk', flat=True), '')
+    for product_id, digest in ProductImageVariant.objects.filter(
+        product_id__in=versions,
+    ).values_list('product_id', 'source_digest').distinct():
+        versions[product_id] = digest[:IMAGE_VERSION_LENGTH]
+    return versions
+
+
+def best_variant(product_id, width=None, accept=''):
+    """
+    Pick the smallest variant at least `width` wide (or the largest one when none is), preferring
+    WebP when the client accepts it. Returns None when no variants exist yet.
+    """
+    formats = ['WEBP', 'JPEG'] if 'image/webp' in accept else ['JPEG']
+    candidates = ProductImageVariant.objects.filter(product_id=product_id, format__in=formats)
+    if width:
+        # '-format' puts WEBP ahead of JPEG at equal widths
+        variant = candidates.filter(width__gte=width).order_by('width', '-format').first()
+        if variant:
+            return variant
+    return candidates.order_by('-width', '-format').first()
+
+
+def original_content_type(data):
+    try:
+        with Image.open(BytesIO(bytes(data))) as image:
+            return image.get_format_mimetype() or 'application/octet-stream'
+    except IMAGE_ERRORS:
+        return 'application/octet-stream'
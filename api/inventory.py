@@ -0,0 +1,189 @@
+from django.db import transaction
+from django.db.models import Sum
+
+from .catalog import adjust_category_counts
+from .models import Stock, Product, VariantAvailability, ProductAvailability
+
+
+def _stock_for_variants(variants):
+    """ Stock rows for a set of (size_id, color_id) pairs, loaded with a single query. """
+    size_ids = {size_id for size_id, _ in variants}
+    color_ids = {color_id for _, color_id in variants}
+    return Stock.objects.filter(size_id__in=size_ids, color_id__in=color_ids)
+
+
+def available_quantities(variants):
+    """ Map each (size_id, color_id) pair to its total on-hand quantity across all stores. """
+    variants = set(variants)
+    if not variants:
+        return {}
+    size_ids = {size_id for size_id, _ in variants}
+    color_ids = {color_id for _, color_id in variants}
+    rows = VariantAvailability.objects.filter(
+        size_id__in=size_ids, color_id__in=color_ids
+    ).values_list('size_id', 'color_id', 'quantity')
+    quantities = dict.fromkeys(variants, 0)
+    for size_id, color_id, quantity in rows:
+        if (size_id, color_id) in quantities:
+            quantities[(size_id, color_id)] = quantity
+    return quantities
+
+
+def refresh_availability(variants):
+    """
+    Recompute VariantAvailability and ProductAvailability for the given (size_id, color_id) pairs
+    from Stock. Pairs or products left without stock rows lose their availability row instead of
+    being written as 0, so this is safe to run while Stock is being cascade-deleted.
+    """
+    variants = set(variants)
+    if not variants:
+        return
+
+    with transaction.atomic():
+        totals = {}
+        rows = _stock_for_variants(variants).values('size_id', 'color_id').annotate(total=Sum('quantity'))
+        for row in rows:
+            key = (row['size_id'], row['color_id'])
+            if key in variants:
+                totals[key] = row['total']
+
+        stale = variants - totals.keys()
+        for size_id, color_id in stale:
+            VariantAvailability.objects.filter(size_id=size_id, color_id=color_id).delete()
+        if totals:
+            VariantAvailability.objects.bulk_create(
+                [VariantAvailability(size_id=size_id, color_id=color_id, quantity=quantity)
+                 for (size_id, color_id), quantity in totals.items()],
+                update_conflicts=True,
+                unique_fields=['size', 'color'],
+                update_fields=['quantity'],
+            )
+
+        products = {
+            product_id: (category_id, quantity)
+            for product_id, category_id, quantity in Product.objects.filter(
+                sizeproduct__id__in={size_id for size_id, _ in variants}
+            ).values_list('id', 'category_id', 'availability__quantity').distinct()
+        }
+        product_ids = set(products)
+        product_totals = dict(Stock.objects.filter(size__product_id__in=product_ids).values(
+            'size__product_id'
+        ).annotate(total=Sum('quantity')).values_list('size__product_id', 'total'))
+
+        ProductAvailability.objects.filter(product_id__in=product_ids - product_totals.keys()).delete()
+        if product_totals:
+            ProductAvailability.objects.bulk_create(
+                [ProductAvailability(product_id=product_id, quantity=quantity)
+                 for product_id, quantity in product_totals.items()],
+                update_conflicts=True,
+                unique_fields=['product'],
+                update_fields=['quantity'],
+            )
+
+        # Keep the cached per-category in-stock counts in step with products crossing zero
+        for product_id, (category_id, old_quantity) in products.items():
+            was_in_stock = (old_quantity or 0) > 0
+            is_in_stock = product_totals.get(product_id, 0) > 0
+            if was_in_stock != is_in_stock:
+                adjust_category_counts(category_id, in_stock=1 if is_in_stock else -1)
+
+
+def plan_fulfillment(demand, stock_levels):
+    """
+    Split a {(size_id, color_id): quantity} demand across stores, using as few stores as possible.
+
+    stock_levels maps store_id -> {(size_id, color_id): quantity}. This is greedy set cover: each
+    round picks the store that can ship the most outstanding units (ties go to the store that
+    completes more lines, then the lowest id) and takes everything it can from it. Store scores
+    are kept incrementally, so each round only revisits stores holding the variants just taken.
+
+    Returns {store_id: {(size_id, color_id): quantity}}. Raises ValueError when the stores
+    together cannot cover the demand.
+    """
+    remaining = {variant: quantity for variant, quantity in demand.items() if quantity > 0}
+    holders = {variant: [] for variant in remaining}
+    for store_id, levels in stock_levels.items():
+        for variant, capacity in levels.items():
+            if capacity > 0 and variant in holders:
+                holders[variant].append((store_id, capacity))
+
+    units = dict.fromkeys(stock_levels, 0)
+    lines = dict.fromkeys(stock_levels, 0)
+    for variant, quantity in remaining.items():
+        if sum(capacity for _, capacity in holders[variant]) < quantity:
+            raise ValueError("Insufficient stock for one or more items.")
+        for store_id, capacity in holders[variant]:
+            if capacity >= quantity:
+                units[store_id] += quantity
+                lines[store_id] += 1
+            else:
+                units[store_id] += capacity
+
+    plan = {}
+    while remaining:
+        store_id = max(units, key=lambda candidate: (units[candidate], lines[candidate], -candidate))
+        del units[store_id]
+        shipment = {}
+        for variant, capacity in stock_levels[store_id].items():
+            needed = remaining.get(variant)
+            if not needed or capacity <= 0:
+                continue
+            taken = capacity if capacity < needed else needed
+            shipment[variant] = taken
+            left = needed - taken
+            for holder, held in holders[variant]:
+                if holder not in units:
+                    continue
+                # Swap the holder's old contribution for this line with its new one
+                if held >= needed:
+                    units[holder] -= needed - (left if held >= left else held)
+                    lines[holder] -= 1
+                elif held > left:
+                    units[holder] -= held - left
+                if left and held >= left:
+                    lines[holder] += 1
+            if left:
+                remaining[variant] = left
+            else:
+                del remaining[variant]
+        plan[store_id] = shipment
+    return plan
+
+
+def allocate_stock(demand):
+    """
+    Plan fulfillment of a {(size_id, color_id): quantity} demand from a single bulk Stock load,
+    decrement the chosen Stock rows and refresh availability, all in one transaction.
+    Returns the plan from plan_fulfillment().
+    """
+    demand = {variant: quantity for variant, quantity in demand.items() if quantity > 0}
+    if not demand:
+        return {}
+
+    with transaction.atomic():
+        rows = {}
+        stock_levels = {}
+        for stock in _stock_for_variants(demand.keys()).filter(quantity__gt=0).select_for_update():
+            variant = (stock.size_id, stock.color_id)
+            if variant in demand:
+                rows.setdefault((stock.store_id, variant), []).append(stock)
+                levels = stock_levels.setdefault(stock.store_id, {})
+                levels[variant] = levels.get(variant, 0) + stock.quantity
+
+        plan = plan_fulfillment(demand, stock_levels)
+
+        changed = []
+        for store_id, shipment in plan.items():
+            for variant, quantity in shipment.items():
+                # A store may hold the same variant in more than one Stock row
+                for stock in rows[(store_id, variant)]:
+                    taken = min(stock.quantity, quantity)
+                    stock.quantity -= taken
+                    quantity -= taken
+                    changed.append(stock)
+                    if quantity == 0:
+                        break
+
+        Stock.objects.bulk_update(changed, ['quantity'])
+        refresh_availability(demand.keys())
+    return plan
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.exports import ORDER_EXPORT_CHUNK_SIZE, export_orders
+from api.serializers import OrderExportSerializer
+
+
+class Command(BaseCommand):
+    help = "Stream orders (with cart, user and applied vouchers) as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', default='csv', help="csv or ndjson (default: csv)")
+        parser.add_argument('--created-at-min', help="ISO 8601 lower bound on Order.created_at")
+        parser.add_argument('--created-at-max', help="ISO 8601 upper bound on Order.created_at")
+        parser.add_argument('--chunk-size', type=int, default=ORDER_EXPORT_CHUNK_SIZE)
+        parser.add_argument('--output', help="File to write to (default: stdout)")
+
+    def handle(self, *args, **options):
+        params = {'file_format': options['format']}
+        if options['created_at_min']:
+            params['created_at_min'] = options['created_at_min']
+        if options['created_at_max']:
+            params['created_at_max'] = options['created_at_max']
+
+        serializer = OrderExportSerializer(data=params)
+        if not serializer.is_valid():
+            raise CommandError(serializer.errors)
+
+        chunks = export_orders(
+            serializer.validated_data['file_format'],
+            created_at_min=serializer.validated_data.get('created_at_min'),
+            created_at_max=serializer.validated_data.get('created_at_max'),
+            chunk_size=options['chunk_size'],
+        )
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as out:
+                out.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,64 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.images import IMAGE_ERRORS, image_digest, render_variants, store_variants
+from api.models import Product, ProductImageVariant
+
+
+def _render(job):
+    """ Worker entry point: (product_id, digest, image bytes) -> (product_id, digest, variants or error). """
+    product_id, digest, data = job
+    try:
+        return product_id, digest, render_variants(data), None
+    except IMAGE_ERRORS as e:
+        return product_id, digest, None, str(e)
+
+
+class Command(BaseCommand):
+    help = "Generate resized image variants for existing products using a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help="Images loaded from the database per batch (bounds memory)")
+        parser.add_argument('--force', action='store_true', help="Regenerate even if variants are up to date")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        product_ids = list(Product.objects.filter(product_image__isnull=False).values_list('pk', flat=True))
+        current = set()
+        if not options['force']:
+            current = set(ProductImageVariant.objects.values_list('product_id', 'source_digest').distinct())
+
+        # Workers only run Pillow; all database access stays in this process
+        connections.close_all()
+        generated = skipped = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for start in range(0, len(product_ids), options['batch_size']):
+                batch = product_ids[start:start + options['batch_size']]
+                jobs = []
+                for product_id, data in Product.objects.filter(pk__in=batch).values_list('pk', 'product_image'):
+                    if not data:
+                        continue
+                    digest = image_digest(data)
+                    if (product_id, digest) in current:
+                        skipped += 1
+                        continue
+                    jobs.append((product_id, digest, bytes(data)))
+
+                for product_id, digest, variants, error in pool.map(_render, jobs):
+                    if error:
+                        failed += 1
+                        self.stderr.write(f"Product {product_id}: {error}")
+                        continue
+                    store_variants(product_id, digest, variants)
+                    generated += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated variants for {generated} products, skipped {skipped} up to date, {failed} failed "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,86 @@
+import io
+import json
+import pstats
+import re
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.profiling import make_profile_token, profile_dir
+
+# Collapse literals so the same statement with different parameters aggregates together
+SQL_LITERALS = [
+    (re.compile(r'%s'), '?'),
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def normalize_sql(sql):
+    for pattern, replacement in SQL_LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+class Command(BaseCommand):
+    help = "Aggregate request profiles into ranked hot-function and hot-query reports."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help="Profile directory (default: settings.PROFILING_DIR)")
+        parser.add_argument('--path', help="Only include requests whose path contains this string")
+        parser.add_argument('--limit', type=int, default=25)
+        parser.add_argument('--sort', default='cumulative', choices=['cumulative', 'tottime', 'ncalls'])
+        parser.add_argument('--token', action='store_true', help="Print a signed X-Profile-Token and exit")
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(make_profile_token())
+            return
+
+        directory = Path(options['dir']) if options['dir'] else profile_dir()
+        dumps = sorted(directory.glob('*.json')) if directory.is_dir() else []
+        requests = []
+        for dump in dumps:
+            with open(dump, encoding='utf-8') as f:
+                info = json.load(f)
+            if options['path'] and options['path'] not in info['path']:
+                continue
+            requests.append((dump.with_suffix('.prof'), info))
+        if not requests:
+            raise CommandError(f"No profiles found in {directory}.")
+
+        total_time = sum(info['duration'] for _, info in requests)
+        self.stdout.write(f"{len(requests)} requests, {total_time:.3f}s total, "
+                          f"{total_time / len(requests) * 1000:.1f}ms mean\n")
+
+        self._report_functions([prof for prof, _ in requests if prof.exists()], options)
+        self._report_queries([info for _, info in requests], len(requests), options['limit'])
+
+    def _report_functions(self, profiles, options):
+        if not profiles:
+            return
+        buffer = io.StringIO()
+        stats = pstats.Stats(str(profiles[0]), stream=buffer)
+        for profile in profiles[1:]:
+            stats.add(str(profile))
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(options['limit'])
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Hot functions (by {options['sort']})"))
+        self.stdout.write(buffer.getvalue())
+
+    def _report_queries(self, infos, request_count, limit):
+        queries = {}
+        for info in infos:
+            for query in info['queries']:
+                entry = queries.setdefault(normalize_sql(query['sql']), {'count': 0, 'duration': 0.0})
+                entry['count'] += 1
+                entry['duration'] += query['duration']
+
+        self.stdout.write(self.style.MIGRATE_HEADING("Hot queries (by total time)"))
+        ranked = sorted(queries.items(), key=lambda item: item[1]['duration'], reverse=True)[:limit]
+        for sql, entry in ranked:
+            self.stdout.write(
+                f"{entry['duration'] * 1000:10.1f}ms {entry['count']:7d}x "
+                f"{entry['count'] / request_count:6.1f}/req  {sql[:200]}"
+            )
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.1 on 2026-10-19 07:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_availability(apps, schema_editor):
+    Stock = apps.get_model('api', 'Stock')
+    VariantAvailability = apps.get_model('api', 'VariantAvailability')
+    ProductAvailability = apps.get_model('api', 'ProductAvailability')
+
+    VariantAvailability.objects.bulk_create(
+        VariantAvailability(size_id=row['size_id'], color_id=row['color_id'], quantity=row['total'])
+        for row in Stock.objects.values('size_id', 'color_id').annotate(total=Sum('quantity'))
+    )
+    ProductAvailability.objects.bulk_create(
+        ProductAvailability(product_id=row['size__product_id'], quantity=row['total'])
+        for row in Stock.objects.values('size__product_id').annotate(total=Sum('quantity'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_alter_order_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(db_index=True, default=0)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='api.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VariantAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(default=0)),
+                ('color', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.colorproduct')),
+                ('size', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.sizeproduct')),
+            ],
+            options={
+                'unique_together': {('size', 'color')},
+            },
+        ),
+        migrations.RunPython(backfill_availability, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-19 07:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_order_user(apps, schema_editor):
+    Cart = apps.get_model('api', 'Cart')
+    Order = apps.get_model('api', 'Order')
+    Order.objects.filter(user__isnull=True).update(
+        user=Subquery(Cart.objects.filter(pk=OuterRef('cart_id')).values('user_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_availability'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_order_user, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='order_user_history_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.1 on 2026-10-19 07:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+
+def backfill_current_price(apps, schema_editor):
+    Price = apps.get_model('api', 'Price')
+    CurrentPrice = apps.get_model('api', 'CurrentPrice')
+    latest = Price.objects.annotate(rank=Window(
+        RowNumber(),
+        partition_by=[F('size_id'), F('color_id')],
+        order_by=[F('created_at').desc(), F('id').desc()],
+    )).filter(rank=1).values_list('id', 'size_id', 'color_id')
+    CurrentPrice.objects.bulk_create(
+        CurrentPrice(price_id=price_id, size_id=size_id, color_id=color_id)
+        for price_id, size_id, color_id in latest
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_order_user_history'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='price',
+            index=models.Index(fields=['size', 'color', '-created_at', '-id'], name='price_variant_latest_idx'),
+        ),
+        migrations.CreateModel(
+            name='CurrentPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('color', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.colorproduct')),
+                ('price', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.price')),
+                ('size', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.sizeproduct')),
+            ],
+            options={
+                'unique_together': {('size', 'color')},
+            },
+        ),
+        migrations.RunPython(backfill_current_price, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.1 on 2026-10-19 07:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_product_image_variant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesRollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_order_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('dimension', models.CharField(choices=[('total', 'Total'), ('category', 'Category'), ('brand', 'Brand'), ('voucher', 'Voucher')], max_length=20)),
+                ('key', models.IntegerField(default=0)),
+                ('orders', models.IntegerField(default=0)),
+                ('units', models.IntegerField(default=0)),
+                ('sales', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('product_discount', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('voucher_discount', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('shipping_fee', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('shipping_discount', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dimension', 'day'], name='sales_rollup_range_idx')],
+                'unique_together': {('dimension', 'key', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-19 09:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_sales_rollup'),
+    ]
+
+    operations = [
+        # Existing carts are stamped with the migration time, so none of them is purged straight away
+        migrations.AddField(
+            model_name='cart',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
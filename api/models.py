@@ -39,6 +39,18 @@ class Price(models.Model):
     color = models.ForeignKey(ColorProduct, on_delete=models.CASCADE)
     price = models.DecimalField(max_digits=15, decimal_places=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['size', 'color', '-created_at', '-id'], name='price_variant_latest_idx'),
+        ]
+
+class CurrentPrice(models.Model):
+    """ Pointer to the newest Price row of each (size, color), maintained when prices are written. """
+    size = models.ForeignKey(SizeProduct, on_delete=models.CASCADE)
+    color = models.ForeignKey(ColorProduct, on_delete=models.CASCADE)
+    price = models.ForeignKey(Price, on_delete=models.CASCADE)
+    class Meta:
+        unique_together = ('size', 'color')
 
 class Discount(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -108,8 +120,22 @@ class Stock(models.Model):
     store = models.ForeignKey(Store, on_delete=models.CASCADE)
     quantity = models.IntegerField()
 
+class VariantAvailability(models.Model):
+    """ Total on-hand quantity of a (size, color) across all stores, maintained from Stock. """
+    size = models.ForeignKey(SizeProduct, on_delete=models.CASCADE)
+    color = models.ForeignKey(ColorProduct, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=0)
+    class Meta:
+        unique_together = ('size', 'color')
+
+class ProductAvailability(models.Model):
+    """ Total on-hand quantity of a product across all variants and stores, maintained from Stock. """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='availability')
+    quantity = models.IntegerField(default=0, db_index=True)
+
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
@@ -119,6 +145,7 @@ class CartItem(models.Model):
 
 class Order(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)  # Denormalized from cart.user for order history
     payment_method = models.CharField(max_length=255)
     shipping_type = models.CharField(max_length=255)
     is_company_order = models.BooleanField(default=False)
@@ -128,7 +155,11 @@ class Order(models.Model):
     discounted_product = models.DecimalField(max_digits=15, decimal_places=0)
     discounted_shipping = models.DecimalField(max_digits=15, decimal_places=0)
     final_price = models.DecimalField(max_digits=15, decimal_places=0)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_history_idx'),
+        ]
 
 class AppliedVoucher(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
@@ -136,3 +167,86 @@ class AppliedVoucher(models.Model):
     voucher = models.ForeignKey(Voucher, on_delete=models.CASCADE)
     class Meta:
         unique_together = ('user', 'voucher')  # Prevents duplicate use at DB level
+
+class IdempotencyKey(models.Model):
+    """ Stored outcome of a request sent with an Idempotency-Key header, replayed to retries. """
+    key = models.CharField(max_length=255, unique=True)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    locked_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+class ProductLikeActivity(models.Model):
+    """ Net likes per product per day, written when buffered likes are flushed. Feeds trending. """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    day = models.DateField(db_index=True)
+    likes = models.IntegerField(default=0)
+    class Meta:
+        unique_together = ('product', 'day')
+
+class ProductRanking(models.Model):
+    """ Precomputed ranked product id list, e.g. trending overall or best sellers of one category. """
+    TRENDING = 'trending'
+    BEST_SELLERS = 'best_sellers'
+    KIND_CHOICES = [
+        (TRENDING, 'Trending'),
+        (BEST_SELLERS, 'Best sellers'),
+    ]
+
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+    product_ids = models.JSONField(default=list)
+    computed_at = models.DateTimeField()
+    class Meta:
+        unique_together = ('kind', 'category')
+
+class ProductImageVariant(models.Model):
+    """ Resized, recompressed copy of Product.product_image, generated in the background. """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='image_variants')
+    width = models.PositiveIntegerField()
+    format = models.CharField(max_length=10)
+    content_type = models.CharField(max_length=50)
+    data = models.BinaryField()
+    source_digest = models.CharField(max_length=64)  # sha256 of the product_image it was rendered from
+    created_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        unique_together = ('product', 'format', 'width')
+
+class SalesRollup(models.Model):
+    """
+    One day of sales, overall or for one category, brand or voucher, maintained incrementally by
+    api.analytics. Category and brand rows split each order by the list value of its items.
+    """
+    TOTAL = 'total'
+    CATEGORY = 'category'
+    BRAND = 'brand'
+    VOUCHER = 'voucher'
+    DIMENSION_CHOICES = [
+        (TOTAL, 'Total'),
+        (CATEGORY, 'Category'),
+        (BRAND, 'Brand'),
+        (VOUCHER, 'Voucher'),
+    ]
+
+    day = models.DateField()
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    key = models.IntegerField(default=0)  # Category, brand or voucher id; 0 for totals. Not a FK so history survives deletes
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    sales = models.DecimalField(max_digits=17, decimal_places=2, default=0)  # Order.total_price, after product discounts
+    product_discount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    voucher_discount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    shipping_fee = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    shipping_discount = models.DecimalField(max_digits=17, decimal_places=2, default=0)
+    revenue = models.DecimalField(max_digits=17, decimal_places=2, default=0)  # Order.final_price
+    class Meta:
+        unique_together = ('dimension', 'key', 'day')
+        indexes = [
+            models.Index(fields=['dimension', 'day'], name='sales_rollup_range_idx'),
+        ]
+
+class SalesRollupState(models.Model):
+    """ Single-row watermark: every order up to last_order_id is included in SalesRollup. """
+    last_order_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
@@ -1,4 +1,4 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class CategoryPagination(PageNumberPagination):
@@ -7,4 +7,11 @@ class CategoryPagination(PageNumberPagination):
 
 class ProductPagination(PageNumberPagination):
     page_size = 10  # Set the default page size
-    page_query_param = 'page'
\ No newline at end of file
+    page_query_param = 'page'
+
+class OrderHistoryPagination(CursorPagination):
+    # Keyset pagination over the (user, -created_at, -id) index, so deep pages cost the same as the first
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,16 @@
+from rest_framework.permissions import BasePermission
+
+
+class IsSuperUser(BasePermission):
+    """ The custom User model has no is_staff flag, so gate internal endpoints on is_superuser. """
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and request.user.is_superuser)
+
+
+class IsAccountOwnerOrSuperUser(BasePermission):
+    """ For per-user URLs (`<int:user_id>`): only that user, or a superuser, may access them. """
+    def has_permission(self, request, view):
+        user = request.user
+        if not (user and user.is_authenticated):
+            return False
+        return user.is_superuser or user.pk == view.kwargs.get('user_id')
@@ -0,0 +1,174 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import Price, CurrentPrice, Discount, Voucher, AppliedVoucher
+
+# Temporary shipping cost logic
+SHIPPING_FEE = Decimal(5000)
+
+
+def _for_variants(queryset, variants):
+    """ Narrow a queryset to a set of (size_id, color_id) pairs; callers drop non-matching pairs. """
+    return queryset.filter(
+        size_id__in={size_id for size_id, _ in variants},
+        color_id__in={color_id for _, color_id in variants},
+    )
+
+
+def latest_prices(variants):
+    """
+    Newest Price per (size_id, color_id) computed straight from the price history, in one
+    window-function query. current_prices() reads the maintained pointers instead.
+    """
+    variants = set(variants)
+    if not variants:
+        return {}
+    ranked = _for_variants(Price.objects, variants).annotate(rank=Window(
+        RowNumber(),
+        partition_by=[F('size_id'), F('color_id')],
+        order_by=[F('created_at').desc(), F('id').desc()],
+    )).filter(rank=1)
+    return {
+        (price.size_id, price.color_id): price
+        for price in ranked if (price.size_id, price.color_id) in variants
+    }
+
+
+def current_prices(variants):
+    """ Map each (size_id, color_id) pair that has a price to its newest Price, in one indexed query. """
+    variants = set(variants)
+    if not variants:
+        return {}
+    pointers = _for_variants(CurrentPrice.objects, variants).select_related('price')
+    return {
+        (pointer.size_id, pointer.color_id): pointer.price
+        for pointer in pointers if (pointer.size_id, pointer.color_id) in variants
+    }
+
+
+def refresh_current_prices(variants):
+    """ Repoint CurrentPrice at the newest Price of each given pair, dropping pairs with no price left. """
+    variants = set(variants)
+    if not variants:
+        return
+    with transaction.atomic():
+        latest = latest_prices(variants)
+        for size_id, color_id in variants - latest.keys():
+            CurrentPrice.objects.filter(size_id=size_id, color_id=color_id).delete()
+        if latest:
+            CurrentPrice.objects.bulk_create(
+                [CurrentPrice(size_id=size_id, color_id=color_id, price=price)
+                 for (size_id, color_id), price in latest.items()],
+                update_conflicts=True,
+                unique_fields=['size', 'color'],
+                update_fields=['price'],
+            )
+
+
+def voucher_discount(voucher, total_price):
+    """ Amount a voucher takes off `total_price`, or None when it has neither a flat nor a percent discount. """
+    if voucher.discount_flat:
+        return min(Decimal(voucher.discount_flat), Decimal(voucher.max_discount or voucher.discount_flat))
+    if voucher.discount_percent:
+        discount_amount = Decimal(total_price) * (Decimal(voucher.discount_percent) / Decimal(100))
+        return min(discount_amount, Decimal(voucher.max_discount))
+    return None
+
+
+def price_cart(cart_items, user, voucher_ids):
+    """
+    Price cart items the way order creation charges them: current Price per (size, color), the
+    active product Discount, then the requested vouchers. Prices and discounts for the whole cart
+    are loaded with one query each. Raises ValueError when a line has no price or a voucher was
+    already used by the user.
+    """
+    now = timezone.now()
+    lines = []
+    total_price = Decimal(0)
+    discounted_product = Decimal(0)
+
+    prices = current_prices((item.size_id, item.color_id) for item in cart_items)
+    discounts = {}
+    for discount in Discount.objects.filter(
+        product_id__in={item.size.product_id for item in cart_items},
+        start_at__lte=now,
+        end_at__gte=now
+    ).order_by('id'):
+        discounts.setdefault(discount.product_id, discount)
+
+    for item in cart_items:
+        price_obj = prices.get((item.size_id, item.color_id))
+        if not price_obj:
+            raise ValueError("Price not found for selected size and color.")
+
+        price = price_obj.price * item.quantity
+        product_discount = Decimal(0)
+
+        discount = discounts.get(item.size.product_id)
+
+        if discount:
+            product_discount = price * (discount.discount_percent / Decimal(100))
+            discounted_product += product_discount
+            price -= product_discount
+
+        total_price += price
+        lines.append({
+            "cart_item_id": item.id,
+            "product_id": item.size.product_id,
+            "size_id": item.size_id,
+            "color_id": item.color_id,
+            "quantity": item.quantity,
+            "unit_price": price_obj.price,
+            "discount": product_discount,
+            "price": price,
+        })
+
+    shipping_fee = SHIPPING_FEE
+    discounted_shipping = Decimal(0)
+
+    total_voucher_discount = Decimal(0)
+    applied_voucher_ids = []
+    for voucher_id in voucher_ids:
+        voucher = Voucher.objects.filter(
+            id=voucher_id,
+            start_at__lte=now,
+            end_at__gte=now
+        ).first()
+        if not voucher:
+            continue
+        # Prevent reuse of previously applied voucher
+        if AppliedVoucher.objects.filter(user=user, voucher=voucher).exists():
+            raise ValueError(f"Voucher ID {voucher_id} has already been used by this user.")
+        discount_amount = voucher_discount(voucher, total_price)
+        if discount_amount is None:
+            continue
+        total_voucher_discount += discount_amount
+        applied_voucher_ids.append(voucher.id)
+    discounted_product += total_voucher_discount
+
+    final_price = total_price + shipping_fee - discounted_product - discounted_shipping - total_voucher_discount
+
+    return {
+        "lines": lines,
+        "voucher_ids": applied_voucher_ids,
+        "total_price": total_price,
+        "shipping_fee": shipping_fee,
+        "discounted_product": discounted_product,
+        "discounted_shipping": discounted_shipping,
+        "voucher_discount": total_voucher_discount,
+        "final_price": final_price,
+    }
+
+
+def applicable_vouchers(user):
+    """ Visible vouchers that are active now and that the user has not used yet. """
+    now = timezone.now()
+    return Voucher.objects.filter(
+        visible=True,
+        start_at__lte=now,
+        end_at__gte=now
+    ).exclude(appliedvoucher__user=user).order_by('end_at', 'id')
@@ -0,0 +1,103 @@
+import cProfile
+import json
+import random
+import re
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+
+PROFILE_HEADER = 'X-Profile-Token'
+PROFILE_TOKEN_SALT = 'api.profiling'
+PROFILE_TOKEN_MAX_AGE = 60 * 60
+
+
+def make_profile_token():
+    """ Signed token that enables profiling for requests carrying it in the X-Profile-Token header. """
+    return signing.TimestampSigner(salt=PROFILE_TOKEN_SALT).sign('profile')
+
+
+def _has_valid_token(request):
+    token = request.headers.get(PROFILE_HEADER)
+    if not token:
+        return False
+    try:
+        signing.TimestampSigner(salt=PROFILE_TOKEN_SALT).unsign(token, max_age=PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+
+
+class QueryRecorder:
+    """ connection.execute_wrapper() hook that records every SQL statement and its duration. """
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': self.alias,
+                'sql': sql,
+                'many': many,
+                'duration': time.perf_counter() - started,
+            })
+
+
+class ProfilingMiddleware:
+    """
+    Profile a request with cProfile and record its SQL when it carries a valid X-Profile-Token
+    header, or for a random PROFILING_SAMPLE_RATE fraction of requests. Each profiled request
+    writes <name>.prof (pstats) and <name>.json (request info and SQL) into PROFILING_DIR.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        if not (_has_valid_token(request) or (sample_rate and random.random() < sample_rate)):
+            return self.get_response(request)
+
+        recorders = [QueryRecorder(connection.alias) for connection in connections.all()]
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection, recorder in zip(connections.all(), recorders):
+                stack.enter_context(connection.execute_wrapper(recorder))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        elapsed = time.perf_counter() - started
+
+        self._dump(request, response, profiler, recorders, elapsed)
+        return response
+
+    def _dump(self, request, response, profiler, recorders, elapsed):
+        directory = profile_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-') or 'root'
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{request.method}-{slug}-{uuid.uuid4().hex[:8]}"
+
+        profiler.dump_stats(directory / f"{name}.prof")
+        with open(directory / f"{name}.json", 'w', encoding='utf-8') as out:
+            json.dump({
+                'method': request.method,
+                'path': request.path,
+                'query_string': request.META.get('QUERY_STRING', ''),
+                'status_code': response.status_code,
+                'duration': elapsed,
+                'queries': [query for recorder in recorders for query in recorder.queries],
+            }, out, indent=1)
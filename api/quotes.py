@@ -0,0 +1,106 @@
+import math
+import time
+
+from django.core.cache import cache
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from .models import CartItem, Discount, Voucher
+from .pricing import price_cart, applicable_vouchers
+
+CART_QUOTE_TIMEOUT = 60 * 15
+
+PRICING_VERSION_KEY = 'quote_version:pricing'
+CART_VERSION_KEY = 'quote_version:cart:{}'
+USER_VERSION_KEY = 'quote_version:user:{}'
+
+
+def _version(key):
+    # Seed with a timestamp so a culled version key can never resurrect an old cache entry
+    cache.add(key, time.time_ns(), timeout=None)
+    return cache.get(key)
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def invalidate_pricing():
+    """ Price, Discount or Voucher rows changed: every memoized quote is stale. """
+    _bump(PRICING_VERSION_KEY)
+
+
+def invalidate_cart_quote(cart_id):
+    _bump(CART_VERSION_KEY.format(cart_id))
+
+
+def invalidate_user_quotes(user_id):
+    """ Voucher applicability depends on which vouchers the user already used. """
+    _bump(USER_VERSION_KEY.format(user_id))
+
+
+def _timeout_until_next_boundary(product_ids):
+    """ Seconds until the next discount or voucher that could affect this cart starts or ends. """
+    now = timezone.now()
+    timeout = CART_QUOTE_TIMEOUT
+    for queryset in (Discount.objects.filter(product_id__in=product_ids), Voucher.objects.all()):
+        boundaries = queryset.aggregate(
+            next_start=Min('start_at', filter=Q(start_at__gt=now)),
+            next_end=Min('end_at', filter=Q(end_at__gte=now)),
+        )
+        for boundary in boundaries.values():
+            if boundary is not None:
+                timeout = min(timeout, math.ceil((boundary - now).total_seconds()) + 1)
+    return timeout
+
+
+def _serialize(quote):
+    """ Decimals become strings, matching how DecimalField renders them elsewhere in the API. """
+    return {
+        **{key: str(value) for key, value in quote.items() if key not in ('lines', 'voucher_ids')},
+        "voucher_ids": quote["voucher_ids"],
+        "lines": [
+            {key: str(value) if key in ('unit_price', 'discount', 'price') else value for key, value in line.items()}
+            for line in quote["lines"]
+        ],
+    }
+
+
+def get_cart_quote(cart, voucher_ids=()):
+    """
+    Price a cart without placing an order, memoized per (cart, vouchers). The cache key embeds
+    version counters for pricing data, the cart's items and the user's voucher usage, so any
+    change to those rows makes older entries unreachable instead of deleting them one by one.
+    """
+    voucher_ids = sorted(set(voucher_ids))
+    key = 'cart_quote:{}:{}:{}:{}:{}'.format(
+        cart.id,
+        _version(PRICING_VERSION_KEY),
+        _version(CART_VERSION_KEY.format(cart.id)),
+        _version(USER_VERSION_KEY.format(cart.user_id)),
+        ','.join(str(voucher_id) for voucher_id in voucher_ids),
+    )
+    quote = cache.get(key)
+    if quote is not None:
+        return quote
+
+    cart_items = list(CartItem.objects.filter(cart=cart).select_related('size'))
+    quote = _serialize(price_cart(cart_items, cart.user, voucher_ids))
+    quote["cart_id"] = cart.id
+    quote["applicable_vouchers"] = [
+        {
+            "id": voucher.id,
+            "description": voucher.description,
+            "discount_percent": None if voucher.discount_percent is None else str(voucher.discount_percent),
+            "discount_flat": None if voucher.discount_flat is None else str(voucher.discount_flat),
+            "max_discount": None if voucher.max_discount is None else str(voucher.max_discount),
+            "end_at": voucher.end_at.isoformat(),
+        }
+        for voucher in applicable_vouchers(cart.user)
+    ]
+
+    cache.set(key, quote, _timeout_until_next_boundary({item.size.product_id for item in cart_items}))
+    return quote
@@ -0,0 +1,95 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import CartItem, ProductLikeActivity, ProductRanking
+
+RANKING_SIZE = 1000
+
+TRENDING_WINDOW = timedelta(days=7)
+TRENDING_HALF_LIFE_DAYS = 2
+TRENDING_LIKE_WEIGHT = 1
+TRENDING_ORDER_WEIGHT = 3  # Per unit ordered
+
+BEST_SELLER_WINDOW = timedelta(days=30)
+
+
+def _ordered_items(since):
+    return CartItem.objects.filter(cart__order__created_at__gte=since)
+
+
+def _top(scores):
+    ranked = sorted((product_id for product_id, score in scores.items() if score > 0),
+                    key=lambda product_id: (-scores[product_id], product_id))
+    return ranked[:RANKING_SIZE]
+
+
+def _store(kind, rankings, computed_at):
+    """ Replace every ranking of `kind` with {category_id or None: [product ids]} in one transaction. """
+    with transaction.atomic():
+        ProductRanking.objects.filter(kind=kind).delete()
+        ProductRanking.objects.bulk_create(
+            ProductRanking(kind=kind, category_id=category_id, product_ids=product_ids, computed_at=computed_at)
+            for category_id, product_ids in rankings.items()
+        )
+
+
+def compute_trending(now=None):
+    """
+    Rank products by recent likes and units ordered, each day's activity decaying by half every
+    TRENDING_HALF_LIFE_DAYS, overall and per category. Two grouped queries over the window,
+    whatever the catalog size.
+    """
+    now = now or timezone.now()
+    since = now - TRENDING_WINDOW
+    today = timezone.localdate(now)
+
+    def decay(day):
+        return 0.5 ** ((today - day).days / TRENDING_HALF_LIFE_DAYS)
+
+    scores = {}
+    categories = {}
+    for product_id, category_id, day, likes in ProductLikeActivity.objects.filter(
+        day__gte=timezone.localdate(since)
+    ).values_list('product_id', 'product__category_id', 'day', 'likes'):
+        scores[product_id] = scores.get(product_id, 0) + TRENDING_LIKE_WEIGHT * likes * decay(day)
+        categories[product_id] = category_id
+    for product_id, category_id, day, units in _ordered_items(since).values(
+        'size__product_id', 'size__product__category_id', day=TruncDate('cart__order__created_at'),
+    ).annotate(units=Sum('quantity')).values_list('size__product_id', 'size__product__category_id', 'day', 'units'):
+        scores[product_id] = scores.get(product_id, 0) + TRENDING_ORDER_WEIGHT * units * decay(day)
+        categories[product_id] = category_id
+
+    by_category = {}
+    for product_id, score in scores.items():
+        by_category.setdefault(categories[product_id], {})[product_id] = score
+    rankings = {category_id: _top(category_scores) for category_id, category_scores in by_category.items()}
+    rankings[None] = _top(scores)
+    _store(ProductRanking.TRENDING, rankings, now)
+    return len(scores)
+
+
+def compute_best_sellers(now=None):
+    """ Rank products by units ordered within BEST_SELLER_WINDOW, overall and per category. """
+    now = now or timezone.now()
+    overall = {}
+    by_category = {}
+    for product_id, category_id, units in _ordered_items(now - BEST_SELLER_WINDOW).values(
+        'size__product_id', 'size__product__category_id',
+    ).annotate(units=Sum('quantity')).values_list('size__product_id', 'size__product__category_id', 'units'):
+        overall[product_id] = overall.get(product_id, 0) + units
+        category_scores = by_category.setdefault(category_id, {})
+        category_scores[product_id] = category_scores.get(product_id, 0) + units
+
+    rankings = {category_id: _top(scores) for category_id, scores in by_category.items()}
+    rankings[None] = _top(overall)
+    _store(ProductRanking.BEST_SELLERS, rankings, now)
+    return len(overall)
+
+
+def ranked_product_ids(kind, category_id=None):
+    ranking = ProductRanking.objects.filter(kind=kind, category_id=category_id).only('product_ids').first()
+    return ranking.product_ids if ranking else []
@@ -1,16 +1,79 @@
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Category, Product, SizeProduct, ColorProduct
+from .analytics import SALES_GROUPINGS
+from .catalog import category_counts
+from .counters import pending_like_deltas
+from .exports import ORDER_EXPORT_FORMATS
+from .images import image_versions
+from .models import Category, Product, SizeProduct, ColorProduct, CartItem, AppliedVoucher, Order
 
 
+class CategoryListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        """ Look up product counts for the whole page with a single cache read. """
+        categories = list(data.all() if hasattr(data, 'all') else data)
+        self.child.context['category_counts'] = category_counts([category.pk for category in categories])
+        return super().to_representation(categories)
+
 class CategorySerializer(serializers.ModelSerializer):
+    product_count = serializers.SerializerMethodField()
+    in_stock_count = serializers.SerializerMethodField()
+
     class Meta:
         model = Category
         fields = '__all__'
+        list_serializer_class = CategoryListSerializer
+
+    def _counts(self, category):
+        counts = self.context.get('category_counts')
+        if counts is None or category.pk not in counts:
+            counts = category_counts([category.pk])
+        return counts[category.pk]
+
+    def get_product_count(self, category):
+        return self._counts(category)['product_count']
+
+    def get_in_stock_count(self, category):
+        return self._counts(category)['in_stock_count']
+
+class ProductListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        """ Add unflushed like deltas and image versions for the whole page, one lookup each. """
+        products = list(data.all() if hasattr(data, 'all') else data)
+        product_ids = [product.pk for product in products]
+        self.child.context['like_deltas'] = pending_like_deltas(product_ids)
+        self.child.context['image_versions'] = image_versions(product_ids)
+        return super().to_representation(products)
 
 class ProductSerializer(serializers.ModelSerializer):
+    image_url = serializers.SerializerMethodField()
+
     class Meta:
         model = Product
-        fields = '__all__'  # You can specify relevant fields instead
+        # The image blob is served by ProductImageView through image_url, never inline
+        exclude = ['product_image']
+        list_serializer_class = ProductListSerializer
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        like_deltas = self.context.get('like_deltas')
+        if like_deltas is None:
+            like_deltas = pending_like_deltas([instance.pk])
+        data['like_count'] = max(data['like_count'] + like_deltas.get(instance.pk, 0), 0)
+        return data
+
+    def get_image_url(self, instance):
+        """
+        Resized variants are served here; add a `width` query parameter for thumbnails. The `v`
+        parameter changes with the image, so responses carrying it can be cached for long.
+        """
+        versions = self.context.get('image_versions')
+        if versions is None:
+            versions = image_versions([instance.pk])
+        if instance.pk not in versions:
+            return None
+        url = reverse('product-image', args=[instance.pk])
+        return f"{url}?v={versions[instance.pk]}" if versions[instance.pk] else url
 
 class CartCreateSerializer(serializers.Serializer):
     user_id = serializers.IntegerField()
@@ -48,3 +111,67 @@ class CartItemBulkCreateSerializer(serializers.Serializer):
 class CartItemBulkCreateSerializer(serializers.Serializer):
     cart_id = serializers.IntegerField()
     items = CartItemSerializer(many=True)
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    product_id = serializers.IntegerField(source='size.product_id')
+    size = serializers.CharField(source='size.size')
+    color = serializers.CharField(source='color.color')
+
+    class Meta:
+        model = CartItem
+        fields = ['id', 'product_id', 'size_id', 'size', 'color_id', 'color', 'quantity']
+
+class OrderVoucherSerializer(serializers.ModelSerializer):
+    description = serializers.CharField(source='voucher.description', allow_null=True)
+
+    class Meta:
+        model = AppliedVoucher
+        fields = ['voucher_id', 'description']
+
+class OrderHistorySerializer(serializers.ModelSerializer):
+    items = OrderItemSerializer(source='cart.cartitem_set', many=True)
+    vouchers = OrderVoucherSerializer(source='appliedvoucher_set', many=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'cart_id', 'created_at', 'payment_method', 'shipping_type', 'is_company_order',
+            'additional_note', 'total_price', 'shipping_fee', 'discounted_product', 'discounted_shipping',
+            'final_price', 'items', 'vouchers',
+        ]
+
+class CartQuoteSerializer(serializers.Serializer):
+    voucher_ids = serializers.CharField(required=False, default='')
+
+    def validate_voucher_ids(self, value):
+        """ Comma-separated ids, e.g. `?voucher_ids=1,3`. """
+        try:
+            return [int(voucher_id) for voucher_id in value.split(',') if voucher_id.strip()]
+        except ValueError:
+            raise serializers.ValidationError('voucher_ids must be a comma-separated list of integers.')
+
+class AutocompleteSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=100, trim_whitespace=True)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+class OrderExportSerializer(serializers.Serializer):
+    file_format = serializers.ChoiceField(choices=ORDER_EXPORT_FORMATS, default='csv')
+    created_at_min = serializers.DateTimeField(required=False)
+    created_at_max = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        created_at_min = data.get('created_at_min')
+        created_at_max = data.get('created_at_max')
+        if created_at_min and created_at_max and created_at_min > created_at_max:
+            raise serializers.ValidationError('created_at_min must not be later than created_at_max.')
+        return data
+
+class SalesAnalyticsSerializer(serializers.Serializer):
+    date_from = serializers.DateField()
+    date_to = serializers.DateField()
+    group_by = serializers.ChoiceField(choices=SALES_GROUPINGS, required=False)
+
+    def validate(self, data):
+        if data['date_from'] > data['date_to']:
+            raise serializers.ValidationError('date_from must not be later than date_to.')
+        return data
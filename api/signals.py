@@ -0,0 +1,103 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .autocomplete import publish_product_changes, publish_rebuild
+from .catalog import adjust_category_counts, recount_category, product_in_stock
+from .inventory import refresh_availability
+from .models import Stock, Product, Brand, Category, CartItem, Price, Discount, Voucher, AppliedVoucher
+from .pricing import refresh_current_prices
+from .quotes import invalidate_pricing, invalidate_cart_quote, invalidate_user_quotes
+from .tasks import generate_product_image_variants
+
+
+@receiver(post_init, sender=Stock)
+def remember_stock_variant(sender, instance, **kwargs):
+    """ Keep the variant a Stock row was loaded with, so moving it to another variant refreshes both. """
+    # Read __dict__ directly so deferred fields are not fetched one row at a time.
+    instance._loaded_variant = (instance.__dict__.get('size_id'), instance.__dict__.get('color_id'))
+
+
+@receiver(post_save, sender=Stock)
+def refresh_availability_on_stock_save(sender, instance, **kwargs):
+    variant = (instance.size_id, instance.color_id)
+    refresh_availability({variant, instance._loaded_variant} - {(None, None)})
+    instance._loaded_variant = variant
+
+
+@receiver(post_delete, sender=Stock)
+def refresh_availability_on_stock_delete(sender, instance, **kwargs):
+    refresh_availability({(instance.size_id, instance.color_id)})
+
+
+@receiver(post_init, sender=Product)
+def remember_product_category(sender, instance, **kwargs):
+    instance._loaded_category_id = instance.__dict__.get('category_id')
+    instance._loaded_image = instance.__dict__.get('product_image')
+
+
+@receiver(post_save, sender=Product)
+def adjust_category_counts_on_product_save(sender, instance, created, **kwargs):
+    if created:
+        adjust_category_counts(instance.category_id, products=1)
+    elif instance._loaded_category_id not in (None, instance.category_id):
+        in_stock = int(product_in_stock(instance.pk))
+        adjust_category_counts(instance._loaded_category_id, products=-1, in_stock=-in_stock)
+        adjust_category_counts(instance.category_id, products=1, in_stock=in_stock)
+    instance._loaded_category_id = instance.category_id
+
+
+@receiver(post_save, sender=Product)
+def generate_image_variants_on_upload(sender, instance, created, **kwargs):
+    if 'product_image' not in instance.__dict__:
+        return
+    if created:
+        changed = bool(instance.product_image)
+    else:
+        changed = instance.product_image != instance._loaded_image
+    if not changed:
+        return
+    instance._loaded_image = instance.product_image
+    product_id = instance.pk
+    transaction.on_commit(lambda: generate_product_image_variants.delay(product_id))
+
+
+@receiver(post_delete, sender=Product)
+def recount_category_on_product_delete(sender, instance, **kwargs):
+    recount_category(instance.category_id)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def refresh_autocomplete_on_product_change(sender, instance, **kwargs):
+    product_id = instance.pk
+    transaction.on_commit(lambda: publish_product_changes([product_id]))
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def rebuild_autocomplete_on_rename(sender, instance, created, **kwargs):
+    # New brands and categories have no products yet; deletions cascade to product signals
+    if not created:
+        transaction.on_commit(publish_rebuild)
+
+
+@receiver([post_save, post_delete], sender=Price)
+def refresh_current_price(sender, instance, **kwargs):
+    refresh_current_prices({(instance.size_id, instance.color_id)})
+
+
+@receiver([post_save, post_delete], sender=Price)
+@receiver([post_save, post_delete], sender=Discount)
+@receiver([post_save, post_delete], sender=Voucher)
+def invalidate_quotes_on_pricing_change(sender, instance, **kwargs):
+    invalidate_pricing()
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def invalidate_quote_on_cart_item_change(sender, instance, **kwargs):
+    invalidate_cart_quote(instance.cart_id)
+
+
+@receiver([post_save, post_delete], sender=AppliedVoucher)
+def invalidate_quotes_on_voucher_use(sender, instance, **kwargs):
+    invalidate_user_quotes(instance.user_id)
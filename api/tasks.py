@@ -1,7 +1,13 @@
+import logging
+
 from celery import shared_task
 from django.core.mail import send_mail
 from django.conf import settings
 
+from . import analytics, carts, counters, idempotency, images, rankings
+
+logger = logging.getLogger(__name__)
+
 @shared_task
 def send_order_confirmation_email(user_email, order_id):
     subject = "Order Confirmation"
@@ -12,4 +18,39 @@ def send_order_confirmation_email(user_email, order_id):
         settings.DEFAULT_FROM_EMAIL,
         [user_email],
         fail_silently=False,
-    )
\ No newline at end of file
+    )
+
+@shared_task
+def flush_product_likes():
+    return counters.flush_product_likes()
+
+@shared_task
+def purge_idempotency_keys():
+    return idempotency.purge_idempotency_keys()
+
+@shared_task
+def compute_trending_rankings():
+    return rankings.compute_trending()
+
+@shared_task
+def compute_best_seller_rankings():
+    return rankings.compute_best_sellers()
+
+@shared_task
+def generate_product_image_variants(product_id):
+    try:
+        return images.generate_variants(product_id)
+    except images.IMAGE_ERRORS as e:
+        # Not an image Pillow can read; keep serving the original blob
+        logger.warning("Could not generate image variants for product %s: %s", product_id, e)
+        return 0
+
+@shared_task
+def update_sales_rollups():
+    return analytics.update_sales_rollups()
+
+@shared_task
+def purge_abandoned_carts():
+    removed = carts.purge_abandoned_carts()
+    logger.info("Purged %(carts)s abandoned carts and %(items)s cart items in %(seconds)ss", removed)
+    return removed
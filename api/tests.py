@@ -0,0 +1,620 @@
+import random
+import time
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
+
+from django.core.cache import caches
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory, APIClient
+from rest_framework.views import APIView
+
+from .autocomplete import KINDS, PrefixIndex, normalize
+from .carts import purge_abandoned_carts
+from .counters import (LIKE_DELTA_KEY, LIKE_PENDING_KEY, LIKE_SLOT_GAP_GRACE, LIKE_SLOT_KEY, LIKE_SLOT_SEQ_KEY,
+                       add_product_like, flush_product_likes, pending_like_deltas)
+from .idempotency import IDEMPOTENCY_KEY_TTL, IDEMPOTENCY_LOCK_TIMEOUT, idempotent, request_fingerprint
+from .inventory import plan_fulfillment
+from .management.commands.generate_image_variants import _render
+from .rankings import compute_trending
+from .models import (Category, Brand, Product, SizeProduct, ColorProduct, Price, Store, Stock, User, Cart, CartItem,
+                     Order, IdempotencyKey, ProductLikeActivity, SalesRollup)
+
+# Tests must not need the Redis server the real cache aliases point at
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test_default'},
+    'counters': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'test_counters',
+                 'TIMEOUT': None},
+}
+
+
+def naive_greedy_plan(demand, stock_levels):
+    """ Reference set cover: rescore every store from scratch each round. """
+    remaining = {variant: quantity for variant, quantity in demand.items() if quantity > 0}
+    stores = set(stock_levels)
+    plan = {}
+    while remaining:
+        def score(store_id):
+            levels = stock_levels[store_id]
+            units = sum(min(levels.get(variant, 0), needed) for variant, needed in remaining.items()
+                        if levels.get(variant, 0) > 0)
+            lines = sum(1 for variant, needed in remaining.items() if levels.get(variant, 0) >= needed)
+            return units, lines, -store_id
+        store_id = max(stores, key=score)
+        stores.discard(store_id)
+        shipment = {}
+        for variant, capacity in stock_levels[store_id].items():
+            needed = remaining.get(variant)
+            if not needed or capacity <= 0:
+                continue
+            shipment[variant] = min(capacity, needed)
+            if capacity >= needed:
+                del remaining[variant]
+            else:
+                remaining[variant] = needed - capacity
+        plan[store_id] = shipment
+    return plan
+
+
+def random_case(rng, stores=20, variants=30, lines=8):
+    catalog = [(size_id, size_id + 1000) for size_id in range(variants)]
+    stock_levels = {
+        store_id: {variant: rng.randint(0, 6) for variant in rng.sample(catalog, rng.randint(1, variants))}
+        for store_id in range(1, stores + 1)
+    }
+    demand = {}
+    for variant in rng.sample(catalog, lines):
+        available = sum(levels.get(variant, 0) for levels in stock_levels.values())
+        if available:
+            demand[variant] = rng.randint(1, available)
+    return demand, stock_levels
+
+
+class PlanFulfillmentTests(SimpleTestCase):
+    def assert_valid_plan(self, plan, demand, stock_levels):
+        shipped = {}
+        for store_id, shipment in plan.items():
+            self.assertTrue(shipment, f"store {store_id} was picked but ships nothing")
+            for variant, quantity in shipment.items():
+                self.assertGreater(quantity, 0)
+                self.assertLessEqual(quantity, stock_levels[store_id].get(variant, 0))
+                shipped[variant] = shipped.get(variant, 0) + quantity
+        self.assertEqual(shipped, {variant: quantity for variant, quantity in demand.items() if quantity > 0})
+
+    def test_single_store_covers_everything(self):
+        demand = {(1, 1): 2, (2, 2): 1}
+        stock_levels = {1: {(1, 1): 1}, 2: {(1, 1): 5, (2, 2): 5}, 3: {(2, 2): 1}}
+        self.assertEqual(plan_fulfillment(demand, stock_levels), {2: {(1, 1): 2, (2, 2): 1}})
+
+    def test_splits_a_line_across_stores(self):
+        demand = {(1, 1): 5}
+        stock_levels = {1: {(1, 1): 3}, 2: {(1, 1): 2}, 3: {(1, 1): 1}}
+        self.assertEqual(plan_fulfillment(demand, stock_levels), {1: {(1, 1): 3}, 2: {(1, 1): 2}})
+
+    def test_ties_go_to_complete_lines_then_lowest_store_id(self):
+        demand = {(1, 1): 2, (2, 2): 2}
+        # Stores 2, 3 and 4 can each ship two units; 3 and 4 also complete a line, and 3 has the lower id
+        stock_levels = {1: {(1, 1): 1}, 2: {(1, 1): 1, (2, 2): 1}, 3: {(2, 2): 2}, 4: {(1, 1): 2}}
+        plan = plan_fulfillment(demand, stock_levels)
+        self.assertEqual(plan, {3: {(2, 2): 2}, 4: {(1, 1): 2}})
+
+    def test_zero_quantity_lines_are_ignored(self):
+        self.assertEqual(plan_fulfillment({(1, 1): 0}, {1: {(1, 1): 5}}), {})
+        self.assertEqual(plan_fulfillment({(1, 1): 1, (2, 2): 0}, {1: {(1, 1): 5}}), {1: {(1, 1): 1}})
+
+    def test_insufficient_stock_raises(self):
+        with self.assertRaisesMessage(ValueError, "Insufficient stock"):
+            plan_fulfillment({(1, 1): 4}, {1: {(1, 1): 2}, 2: {(1, 1): 1}})
+
+    def test_unstocked_variant_raises(self):
+        with self.assertRaises(ValueError):
+            plan_fulfillment({(1, 1): 1, (9, 9): 1}, {1: {(1, 1): 5}})
+
+    def test_matches_naive_greedy(self):
+        rng = random.Random(20261019)
+        for _ in range(300):
+            demand, stock_levels = random_case(rng, stores=rng.randint(1, 12), variants=12, lines=rng.randint(1, 8))
+            plan = plan_fulfillment(demand, stock_levels)
+            self.assert_valid_plan(plan, demand, stock_levels)
+            self.assertEqual(plan, naive_greedy_plan(demand, stock_levels))
+
+    def test_large_case_is_fast(self):
+        rng = random.Random(7)
+        demand, stock_levels = random_case(rng, stores=200, variants=300, lines=40)
+        started = time.perf_counter()
+        plan = plan_fulfillment(demand, stock_levels)
+        elapsed = time.perf_counter() - started
+        self.assert_valid_plan(plan, demand, stock_levels)
+        # Generous bound so slow CI machines don't flake (the naive reference is several times slower)
+        self.assertLess(elapsed, 0.25)
+
+
+class EchoView(APIView):
+    """ Counts its calls and answers with whatever status the test asks for. """
+    calls = 0
+    next_status = status.HTTP_201_CREATED
+    raise_error = None
+
+    @idempotent
+    def post(self, request):
+        type(self).calls += 1
+        if self.raise_error:
+            raise self.raise_error
+        return Response({"call": type(self).calls, "echo": request.data}, status=self.next_status)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class IdempotentDecoratorTests(TestCase):
+    def setUp(self):
+        EchoView.calls = 0
+        EchoView.next_status = status.HTTP_201_CREATED
+        EchoView.raise_error = None
+        self.factory = APIRequestFactory()
+        self.view = EchoView.as_view(throttle_classes=[])
+
+    def post(self, body, key='key-1'):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.view(self.factory.post('/echo/', body, format='json', **headers))
+
+    def test_without_key_runs_every_time(self):
+        self.post({'a': 1}, key=None)
+        self.post({'a': 1}, key=None)
+        self.assertEqual(EchoView.calls, 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_duplicate_is_replayed(self):
+        first = self.post({'a': 1})
+        second = self.post({'a': 1})
+        self.assertEqual(EchoView.calls, 1)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertFalse(first.has_header('Idempotent-Replayed'))
+
+    def test_client_errors_are_final_and_replayed(self):
+        EchoView.next_status = status.HTTP_400_BAD_REQUEST
+        self.post({'a': 1})
+        EchoView.next_status = status.HTTP_201_CREATED
+        replay = self.post({'a': 1})
+        self.assertEqual(EchoView.calls, 1)
+        self.assertEqual(replay.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_different_body_with_same_key_is_422(self):
+        self.post({'a': 1})
+        response = self.post({'a': 2})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(EchoView.calls, 1)
+
+    def test_request_still_running_is_409(self):
+        request = self.factory.post('/echo/', {'a': 1}, format='json')
+        fingerprint = request_fingerprint(EchoView().initialize_request(request))
+        IdempotencyKey.objects.create(key='key-1', fingerprint=fingerprint, locked_at=timezone.now())
+        response = self.post({'a': 1})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(EchoView.calls, 0)
+
+    def test_abandoned_claim_is_taken_over(self):
+        IdempotencyKey.objects.create(key='key-1', fingerprint='crashed worker',
+                                      locked_at=timezone.now() - IDEMPOTENCY_LOCK_TIMEOUT - timedelta(seconds=1))
+        response = self.post({'a': 1})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(EchoView.calls, 1)
+        self.assertEqual(IdempotencyKey.objects.get(key='key-1').status_code, status.HTTP_201_CREATED)
+
+    def test_expired_key_runs_again(self):
+        self.post({'a': 1})
+        IdempotencyKey.objects.update(created_at=timezone.now() - IDEMPOTENCY_KEY_TTL - timedelta(seconds=1))
+        response = self.post({'a': 1})
+        self.assertEqual(EchoView.calls, 2)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+
+    def test_server_error_releases_key(self):
+        EchoView.next_status = status.HTTP_503_SERVICE_UNAVAILABLE
+        self.post({'a': 1})
+        self.assertFalse(IdempotencyKey.objects.exists())
+        EchoView.next_status = status.HTTP_201_CREATED
+        retry = self.post({'a': 1})
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(EchoView.calls, 2)
+
+    def test_exception_releases_key(self):
+        EchoView.raise_error = RuntimeError('boom')
+        with self.assertRaises(RuntimeError):
+            self.post({'a': 1})
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class OrderCreateIdempotencyTests(TestCase):
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        patcher = mock.patch('api.views.send_order_confirmation_email')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(username='buyer', email='buyer@example.com', phone='1', gender='x')
+        product = Product.objects.create(category=Category.objects.create(category='Shoes'),
+                                         brand=Brand.objects.create(brand='Acme'), model='Runner')
+        self.size = SizeProduct.objects.create(product=product, size='42')
+        self.color = ColorProduct.objects.create(product=product, color='red')
+        Price.objects.create(size=self.size, color=self.color, price=1000)
+        Stock.objects.create(size=self.size, color=self.color, store=Store.objects.create(address='A'), quantity=5)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, size=self.size, color=self.color, quantity=2)
+        self.client = APIClient()
+
+    def create_order(self):
+        return self.client.post('/order/create/', {
+            'user_id': self.user.pk, 'cart_id': self.cart.pk, 'payment_method': 'card', 'shipping_type': 'standard',
+        }, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+
+    def test_transient_database_error_can_be_retried(self):
+        with mock.patch('api.views.allocate_stock', side_effect=OperationalError('database is locked')):
+            failed = self.create_order()
+        self.assertEqual(failed.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(Order.objects.exists())
+
+        retry = self.create_order()
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(retry.has_header('Idempotent-Replayed'))
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_duplicate_order_is_replayed(self):
+        first = self.create_order()
+        second = self.create_order()
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data['order_id'], first.data['order_id'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Stock.objects.get().quantity, 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LikeFlushTests(TestCase):
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.cache = caches['counters']
+        category, brand = Category.objects.create(category='Shoes'), Brand.objects.create(brand='Acme')
+        self.first = Product.objects.create(category=category, brand=brand, model='Runner')
+        self.second = Product.objects.create(category=category, brand=brand, model='Walker')
+
+    def like_count(self, product):
+        product.refresh_from_db(fields=['like_count'])
+        return product.like_count
+
+    def reserve_slot(self, product, delta=1):
+        """ The first half of a registration: delta, pending flag and slot number, but no slot yet. """
+        self.cache.add(LIKE_DELTA_KEY.format(product.pk), 0, timeout=None)
+        self.cache.incr(LIKE_DELTA_KEY.format(product.pk), delta)
+        self.cache.add(LIKE_PENDING_KEY.format(product.pk), 1)
+        self.cache.add(LIKE_SLOT_SEQ_KEY, 0, timeout=None)
+        return self.cache.incr(LIKE_SLOT_SEQ_KEY)
+
+    def test_flush_applies_deltas(self):
+        add_product_like(self.first.pk)
+        add_product_like(self.first.pk)
+        add_product_like(self.second.pk)
+        add_product_like(self.second.pk, -1)
+        self.assertEqual(flush_product_likes(), 1)
+        self.assertEqual(self.like_count(self.first), 2)
+        self.assertEqual(self.like_count(self.second), 0)
+        self.assertEqual(pending_like_deltas([self.first.pk, self.second.pk]), {})
+        self.assertEqual(ProductLikeActivity.objects.get(product=self.first).likes, 2)
+        self.assertEqual(flush_product_likes(), 0)
+
+    def test_product_is_flushed_again_after_a_flush(self):
+        add_product_like(self.first.pk)
+        flush_product_likes()
+        add_product_like(self.first.pk)
+        self.assertEqual(flush_product_likes(), 1)
+        self.assertEqual(self.like_count(self.first), 2)
+
+    def test_slot_being_written_is_not_skipped(self):
+        seq = self.reserve_slot(self.first)
+        add_product_like(self.second.pk)
+        # Flush lands between the slot number being reserved and the slot being written
+        self.assertEqual(flush_product_likes(), 0)
+        self.cache.set(LIKE_SLOT_KEY.format(seq), self.first.pk, timeout=None)
+        self.assertEqual(flush_product_likes(), 2)
+        self.assertEqual(self.like_count(self.first), 1)
+        self.assertEqual(self.like_count(self.second), 1)
+
+        add_product_like(self.first.pk)
+        flush_product_likes()
+        self.assertEqual(self.like_count(self.first), 2)
+
+    def test_abandoned_slot_is_skipped_after_grace(self):
+        self.reserve_slot(self.first)
+        add_product_like(self.second.pk)
+        now = time.time()
+        with mock.patch('api.counters.time.time', return_value=now):
+            self.assertEqual(flush_product_likes(), 0)
+        with mock.patch('api.counters.time.time', return_value=now + LIKE_SLOT_GAP_GRACE):
+            self.assertEqual(flush_product_likes(), 1)
+        self.assertEqual(self.like_count(self.second), 1)
+        self.assertEqual(self.like_count(self.first), 0)
+
+        # The lost registration's pending flag expires, after which the product is flushed again
+        self.cache.delete(LIKE_PENDING_KEY.format(self.first.pk))
+        add_product_like(self.first.pk)
+        flush_product_likes()
+        self.assertEqual(self.like_count(self.first), 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ProductLikeViewTests(TestCase):
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.product = Product.objects.create(category=Category.objects.create(category='Shoes'),
+                                              brand=Brand.objects.create(brand='Acme'), model='Runner')
+        self.client = APIClient()
+
+    def listed_like_count(self):
+        return self.client.get('/product/').data['results'][0]['like_count']
+
+    def test_product_list_shows_pending_likes(self):
+        self.client.post(f'/product/{self.product.pk}/like/')
+        self.assertEqual(self.listed_like_count(), 1)
+        self.client.post(f'/product/{self.product.pk}/like/')
+        self.assertEqual(self.listed_like_count(), 2)
+
+    def test_unlike_stops_at_zero(self):
+        self.client.post(f'/product/{self.product.pk}/like/')
+        for _ in range(3):
+            response = self.client.delete(f'/product/{self.product.pk}/like/')
+        self.assertEqual(response.data['like_count'], 0)
+        self.assertEqual(self.listed_like_count(), 0)
+        response = self.client.post(f'/product/{self.product.pk}/like/')
+        self.assertEqual(response.data['like_count'], 1)
+
+    def test_flush_never_stores_a_negative_count(self):
+        add_product_like(self.product.pk, -1)
+        self.assertEqual(self.listed_like_count(), 0)
+        flush_product_likes()
+        self.product.refresh_from_db(fields=['like_count'])
+        self.assertEqual(self.product.like_count, 0)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TrendingRankingTests(TestCase):
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        brand = Brand.objects.create(brand='Acme')
+        self.shoes, self.hats = Category.objects.create(category='Shoes'), Category.objects.create(category='Hats')
+        self.runner = Product.objects.create(category=self.shoes, brand=brand, model='Runner')
+        self.walker = Product.objects.create(category=self.shoes, brand=brand, model='Walker')
+        self.cap = Product.objects.create(category=self.hats, brand=brand, model='Cap')
+        today = timezone.localdate()
+        for product, likes in ((self.runner, 2), (self.walker, 5), (self.cap, 3)):
+            ProductLikeActivity.objects.create(product=product, day=today, likes=likes)
+        self.client = APIClient()
+
+    def trending_ids(self, query=''):
+        return [product['id'] for product in self.client.get(f'/product/trending/{query}').data['results']]
+
+    def test_trending_is_ranked_overall_and_per_category(self):
+        compute_trending()
+        self.assertEqual(self.trending_ids(), [self.walker.pk, self.cap.pk, self.runner.pk])
+        self.assertEqual(self.trending_ids(f'?category_id={self.shoes.pk}'), [self.walker.pk, self.runner.pk])
+        self.assertEqual(self.trending_ids(f'?category_id={self.hats.pk}'), [self.cap.pk])
+
+
+class RenderImageTests(SimpleTestCase):
+    def png(self, width, height):
+        buffer = BytesIO()
+        Image.new('RGB', (width, height)).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_renders_variants(self):
+        product_id, digest, variants, error = _render((1, 'digest', self.png(200, 100)))
+        self.assertIsNone(error)
+        self.assertEqual({(width, image_format) for width, image_format, _, _ in variants},
+                         {(160, 'WEBP'), (160, 'JPEG'), (200, 'WEBP'), (200, 'JPEG')})
+
+    def test_unreadable_images_fail_without_raising(self):
+        self.assertIsNotNone(_render((1, 'digest', b'not an image'))[3])
+        with mock.patch.object(Image, 'MAX_IMAGE_PIXELS', 10):
+            self.assertIn('decompression bomb', _render((2, 'digest', self.png(200, 100)))[3])
+
+
+PRODUCT_NAME_SYLLABLES = ['ka', 'lo', 'ri', 'max', 'run', 'ner', 'ul', 'tra', 'air', 'zo', 'pe', 'sta', 'vin', 'gor',
+                          'mi', 'ta', 'bel', 'on', 'ex', 'pro', 'fit', 'ne', 'sol', 'dar', 'ki', 'ro', 'lu', 'ven']
+
+
+def synthetic_products(count, seed=0):
+    """ (id, model, brand, category, like_count) rows: few brands and categories, many models, skewed likes. """
+    rng = random.Random(seed)
+
+    def word(syllables):
+        return ''.join(rng.choice(PRODUCT_NAME_SYLLABLES) for _ in range(syllables)).capitalize()
+
+    brands = [word(rng.randint(2, 3)) for _ in range(3000)]
+    categories = [word(rng.randint(2, 4)) for _ in range(400)]
+    lines = [word(rng.randint(1, 3)) for _ in range(3000)]
+    for product_id in range(1, count + 1):
+        model = f"{rng.choice(lines)} {word(1)} {rng.randint(1, 30)}"
+        yield product_id, model, rng.choice(brands), rng.choice(categories), int(rng.paretovariate(1.2)) - 1
+
+
+class PrefixIndexTests(SimpleTestCase):
+    def setUp(self):
+        # Tiny limits so a handful of names gives top lists that fill up and get dropped
+        for name, value in (('SCAN_LIMIT', 3), ('PRECOMPUTED_TOP_SIZE', 4)):
+            patcher = mock.patch(f'api.autocomplete.{name}', value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def assert_search_matches(self, index, rows, prefix, limit=4):
+        """ Compare with a brute-force ranking; ties may come back in any order. """
+        scores = {}
+        for _, *texts, likes in rows.values():
+            for kind, text in zip(KINDS, texts):
+                if normalize(text):
+                    scores[(kind, normalize(text))] = scores.get((kind, normalize(text)), 0) + likes
+        matching = {entry: score for entry, score in scores.items()
+                    if f' {entry[1]}'.find(f' {normalize(prefix)}') >= 0}
+        results = [((kind, normalize(text)), score) for text, kind, score in index.search(prefix, limit)]
+        self.assertEqual([score for _, score in results], sorted(matching.values(), reverse=True)[:limit], prefix)
+        self.assertEqual(len({entry for entry, _ in results}), len(results))
+        for entry, score in results:
+            self.assertEqual(matching.get(entry), score)
+
+    def test_word_starts_match(self):
+        index = PrefixIndex()
+        index.load([(1, 'Air Max 90', 'Nike', 'Running Shoes', 5), (2, 'Air  Force', 'nike', 'Shoes', 2)])
+        self.assertEqual(index.search('max'), [('Air Max 90', 'model', 5)])
+        self.assertEqual(index.search('NIKE'), [('Nike', 'brand', 7)])
+        self.assertEqual(index.search('air f'), [('Air  Force', 'model', 2)])
+        self.assertEqual(index.search('shoes'), [('Running Shoes', 'category', 5), ('Shoes', 'category', 2)])
+        self.assertEqual(index.search('ax'), [])
+
+    def test_dropping_a_listed_entry_brings_in_the_next_one(self):
+        rows = {pid: (pid, f'ka{pid}', '', '', 10 - pid) for pid in range(10)}
+        index = PrefixIndex()
+        index.load(rows.values())
+        self.assertEqual(len(index._top['ka']), 4)
+
+        rows[0] = (0, 'ka0', '', '', 0)
+        index.apply([rows[0]])
+        self.assertEqual([score for _, _, score in index.search('ka', 4)], [9, 8, 7, 6])
+
+        # An increase is merged into the list in place
+        rows[9] = (9, 'ka9', '', '', 20)
+        index.apply([rows[9]])
+        self.assertEqual(index._top['ka'][0], index._entry_ids[0]['ka9'])
+        self.assertEqual([score for _, _, score in index.search('ka', 4)], [20, 9, 8, 7])
+
+        index.apply([], removed_ids=[9, 1])
+        del rows[9], rows[1]
+        self.assertEqual([score for _, _, score in index.search('ka', 4)], [8, 7, 6, 5])
+        self.assertEqual(index.search('ka9'), [])
+
+    def test_incremental_updates_match_brute_force(self):
+        rng = random.Random(7)
+        words = ['ka', 'kal', 'kalo', 'ru', 'run', 'runner', 'max', 'ma', 'm']
+
+        def product(pid):
+            model = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 3)))
+            return pid, model, rng.choice(words[:4]), rng.choice(['Shoes', 'Running Shoes', 'Kit']), rng.randint(0, 9)
+
+        rows = {pid: product(pid) for pid in range(1, 40)}
+        index = PrefixIndex()
+        index.load(rows.values())
+        prefixes = {word[:end] for word in words + ['shoes', 'kit'] for end in range(1, len(word) + 1)}
+        prefixes |= {'ka r', 'run m', 'zz'}
+        for step in range(300):
+            pid = rng.randint(1, 60)
+            if pid in rows and rng.random() < 0.2:
+                del rows[pid]
+                index.apply([], removed_ids=[pid])
+            else:
+                if pid in rows and rng.random() < 0.7:
+                    # Like or unlike: same names, new count
+                    rows[pid] = rows[pid][:4] + (max(rows[pid][4] + rng.choice([-3, -1, 1, 2]), 0),)
+                else:
+                    rows[pid] = product(pid)
+                index.apply([rows[pid]])
+            self.assertFalse(index._stale)
+            for prefix in prefixes:
+                self.assert_search_matches(index, rows, prefix, limit=rng.choice([1, 4]))
+        self.assertTrue(any(len(top) == 4 for top in index._top.values()))
+
+
+class PrefixIndexScaleTests(SimpleTestCase):
+    """ A million products with half a million distinct names. """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.rows = list(synthetic_products(1_000_000))
+        cls.index = PrefixIndex()
+        cls.index.load(iter(cls.rows))
+
+    def timed(self, function, *args):
+        started = time.perf_counter()
+        function(*args)
+        return time.perf_counter() - started
+
+    def test_every_prefix_length_is_answered_within_a_millisecond(self):
+        rng = random.Random(3)
+        prefixes = ['k', 'ka', 'kal', 'run', 'max', 'ultr', 'pro 1', 'kalomax', 'zz']
+        for _ in range(1000):
+            _, model, brand, category, _ = rng.choice(self.rows)
+            text = normalize(rng.choice([model, brand, category]))
+            start = rng.choice([0] + [i + 1 for i, char in enumerate(text) if char == ' '])
+            prefixes.append(text[start:start + rng.randint(1, 8)])
+        for prefix in prefixes:
+            self.index.search(prefix)
+        times = sorted(min(self.timed(self.index.search, prefix) for _ in range(3)) for prefix in prefixes)
+        self.assertLess(times[-1], 0.001)
+
+    def test_updates_stay_cheap(self):
+        rng = random.Random(4)
+        changed = [row[:4] + (row[4] + rng.randint(-5, 50),) for row in rng.sample(self.rows, 200)]
+        # Unliking the best-liked product drops full top lists, which are then recomputed
+        changed.append(max(self.rows, key=lambda row: row[4])[:4] + (0,))
+        self.assertLess(self.timed(self.index.apply, changed), 0.5)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SalesAnalyticsViewTests(TestCase):
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='admin', email='admin@example.com', phone='1',
+                                                           gender='x', is_superuser=True))
+        today = timezone.localdate()
+        for day, revenue in ((today, '4999.99'), (today - timedelta(days=1), '2000.01')):
+            SalesRollup.objects.create(day=day, dimension=SalesRollup.TOTAL, orders=1, units=2, sales=revenue,
+                                       revenue=revenue)
+
+    def test_amounts_are_decimal_strings(self):
+        today = timezone.localdate()
+        response = self.client.get('/analytics/sales/', {'date_from': today - timedelta(days=1), 'date_to': today})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        row = response.json()['results'][0]
+        self.assertEqual(row['revenue'], '7000.00')
+        self.assertEqual(row['voucher_discount'], '0.00')
+        self.assertEqual(row['orders'], 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PurgeAbandonedCartsTests(TestCase):
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.user = User.objects.create(username='buyer', email='buyer@example.com', phone='1', gender='x')
+        product = Product.objects.create(category=Category.objects.create(category='Shoes'),
+                                         brand=Brand.objects.create(brand='Acme'), model='Runner')
+        self.size = SizeProduct.objects.create(product=product, size='42')
+        self.color = ColorProduct.objects.create(product=product, color='red')
+
+    def cart(self, age_days, items=2, ordered=False):
+        cart = Cart.objects.create(user=self.user)
+        Cart.objects.filter(pk=cart.pk).update(created_at=timezone.now() - timedelta(days=age_days))
+        for _ in range(items):
+            CartItem.objects.create(cart=cart, size=self.size, color=self.color, quantity=1)
+        if ordered:
+            Order.objects.create(cart=cart, user=self.user, payment_method='card', shipping_type='standard',
+                                 total_price=0, shipping_fee=0, discounted_product=0, discounted_shipping=0,
+                                 final_price=0)
+        return cart
+
+    def test_purges_old_carts_without_orders_in_batches(self):
+        abandoned = [self.cart(40) for _ in range(5)]
+        ordered, recent = self.cart(40, ordered=True), self.cart(1)
+        with mock.patch('api.signals.invalidate_cart_quote') as invalidate:
+            removed = purge_abandoned_carts(batch_size=2)
+        invalidate.assert_not_called()
+        self.assertEqual((removed['carts'], removed['items']), (5, 10))
+        self.assertFalse(Cart.objects.filter(pk__in=[cart.pk for cart in abandoned]).exists())
+        self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {ordered.pk, recent.pk})
+        self.assertEqual(CartItem.objects.count(), 4)
@@ -1,5 +1,6 @@
 from django.urls import path, re_path
 from . import views
+from .models import ProductRanking
 urlpatterns = [
     path('category/', views.CategoryListView.as_view(), name='category'),
     path('category/all/', views.CategoryListView.as_view(), name='category-without-pagination'),
@@ -7,8 +8,18 @@ urlpatterns = [
     path('product/all/', views.ProductListView.as_view(), name='product-without-pagination'),
     path('product/category/<int:category_id>/', views.ProductByCategoryView.as_view(), name='product-category'),
     path('product/category/', views.ProductByCategoryView.as_view(), name='product-category-name'),
+    path('product/autocomplete/', views.ProductAutocompleteView.as_view(), name='product-autocomplete'),
+    path('product/<int:product_id>/like/', views.ProductLikeAPIView.as_view(), name='product-like'),
+    path('product/<int:product_id>/image/', views.ProductImageView.as_view(), name='product-image'),
+    path('product/trending/', views.ProductRankingView.as_view(kind=ProductRanking.TRENDING), name='product-trending'),
+    path('product/best-sellers/', views.ProductRankingView.as_view(kind=ProductRanking.BEST_SELLERS),
+         name='product-best-sellers'),
     path('order/create/', views.OrderCreateAPIView.as_view(), name='order-create'),
+    path('order/export/', views.OrderExportAPIView.as_view(), name='order-export'),
+    path('analytics/sales/', views.SalesAnalyticsAPIView.as_view(), name='analytics-sales'),
+    path('user/<int:user_id>/orders/', views.OrderHistoryView.as_view(), name='order-history'),
     path('cart/create/', views.CartCreateAPIView.as_view(), name='cart-create'),
     path('cart/items/add/', views.CartItemBulkCreateAPIView.as_view(), name='cart-item-create'),
+    path('cart/<int:cart_id>/quote/', views.CartQuoteAPIView.as_view(), name='cart-quote'),
 
 ]
@@ -1,20 +1,32 @@
-from decimal import Decimal
-
-from django.utils import timezone
-from django.db import transaction
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import status
 from rest_framework.generics import ListAPIView, get_object_or_404
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
 from rest_framework.views import APIView
 
+from .analytics import sales_summary, rollup_watermark
+from .autocomplete import autocomplete
+from .counters import add_product_like, pending_like_deltas
+from .exports import export_orders
 from .filters import ProductFilter
-from .models import Category, Product, Cart, CartItem, Price, Discount, Order, Voucher, AppliedVoucher, Stock, User, \
-    SizeProduct, ColorProduct
-from .paginator import CategoryPagination, ProductPagination
-from .serializers import CategorySerializer, ProductSerializer, CartCreateSerializer, CartItemBulkCreateSerializer
+from .idempotency import idempotent
+from .images import best_variant, original_content_type
+from .inventory import available_quantities, allocate_stock
+from .models import Category, Product, Cart, CartItem, Order, Voucher, AppliedVoucher, User, SizeProduct, ColorProduct
+from .paginator import CategoryPagination, ProductPagination, OrderHistoryPagination
+from .permissions import IsSuperUser, IsAccountOwnerOrSuperUser
+from .pricing import price_cart
+from .quotes import get_cart_quote
+from .rankings import ranked_product_ids
+from .serializers import CategorySerializer, ProductSerializer, CartCreateSerializer, CartItemBulkCreateSerializer, \
+    OrderExportSerializer, CartQuoteSerializer, OrderHistorySerializer, AutocompleteSerializer, \
+    SalesAnalyticsSerializer
 from api.tasks import send_order_confirmation_email
 
 class CategoryListView(ListAPIView):
@@ -22,10 +34,6 @@ class CategoryListView(ListAPIView):
     serializer_class = CategorySerializer
     pagination_class = CategoryPagination
 
-    @method_decorator(cache_page(60 * 15))  # Cache response for 15 minutes
-    def dispatch(self, *args, **kwargs):
-        return super().dispatch(*args, **kwargs)
-
     def list(self, request, *args, **kwargs):
         """ Disable pagination when accessing `/category/all/` """
         if request.path == "/category/all/":
@@ -36,17 +44,13 @@ class CategoryListView(ListAPIView):
         return super().list(request, *args, **kwargs)
 
 class ProductListView(ListAPIView):
-    queryset = Product.objects.all()
+    queryset = Product.objects.defer('product_image')
     serializer_class = ProductSerializer
     pagination_class = ProductPagination
 
     filter_backends = [DjangoFilterBackend]
     filterset_class = ProductFilter  # ✅ use the custom filter
 
-    @method_decorator(cache_page(60 * 15))  # Cache response for 15 minutes
-    def dispatch(self, *args, **kwargs):
-        return super().dispatch(*args, **kwargs)
-
     def list(self, request, *args, **kwargs):
         """ Disable pagination when accessing `/product/all/` """
         if request.path == "/product/all/":
@@ -65,17 +69,148 @@ class ProductByCategoryView(ListAPIView):
         category_id = self.kwargs.get('category_id')
         category_name = self.request.query_params.get('category_name', None)
 
+        products = Product.objects.defer('product_image')
         if category_id:
-            return Product.objects.filter(category_id=category_id)
+            return products.filter(category_id=category_id)
 
         if category_name:
             category = get_object_or_404(Category, category=category_name)
-            return Product.objects.filter(category=category)
+            return products.filter(category=category)
 
         return Product.objects.none()
 
 
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """ Image responses are negotiated by hand from the Accept header, so never answer 406. """
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class ProductImageView(APIView):
+    content_negotiation_class = IgnoreClientContentNegotiation
+    # A page of thumbnails is one request per product
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'product_image'
+
+    def get(self, request, product_id):
+        """
+        Serve the smallest generated variant covering `?width=`, or the original until variants exist.
+        Only a variant requested with its current `?v=` version is cached for long.
+        """
+        width = request.query_params.get('width')
+        if width is not None and not width.isdigit():
+            return Response({"error": "width must be a positive integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        variant = best_variant(product_id, int(width) if width else None, request.headers.get('Accept', ''))
+        if variant:
+            response = HttpResponse(bytes(variant.data), content_type=variant.content_type)
+            version = request.query_params.get('v')
+            if version and variant.source_digest.startswith(version):
+                response['Cache-Control'] = 'public, max-age=31536000, immutable'
+            else:
+                response['Cache-Control'] = 'public, max-age=300'
+        else:
+            data = Product.objects.filter(pk=product_id).values_list('product_image', flat=True).first()
+            if not data:
+                return Response({"error": "Image not found."}, status=status.HTTP_404_NOT_FOUND)
+            # Variants are being generated; don't let clients hold on to the full-size original
+            response = HttpResponse(bytes(data), content_type=original_content_type(data))
+            response['Cache-Control'] = 'public, max-age=60'
+        response['Vary'] = 'Accept'
+        return response
+
+
+class ProductRankingView(APIView):
+    kind = None
+    pagination_class = ProductPagination
+
+    def get(self, request):
+        """ Page through a precomputed ranking; only the products on the requested page are loaded. """
+        category_id = request.query_params.get('category_id')
+        if category_id is not None and not category_id.isdigit():
+            return Response({"error": "category_id must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        ranked_ids = ranked_product_ids(self.kind, int(category_id) if category_id else None)
+        paginator = self.pagination_class()
+        page_ids = paginator.paginate_queryset(ranked_ids, request, view=self)
+        products = Product.objects.defer('product_image').in_bulk(page_ids)
+        serializer = ProductSerializer([products[pk] for pk in page_ids if pk in products], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class ProductAutocompleteView(APIView):
+    # Clients call this on every keystroke, so it gets its own, much higher, rate
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'autocomplete'
+
+    def get(self, request):
+        """ Typeahead suggestions for product model, brand and category names, answered from memory. """
+        serializer = AutocompleteSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        suggestions = autocomplete(serializer.validated_data['q'], serializer.validated_data['limit'])
+        return Response(
+            [{"text": text, "kind": kind, "like_count": score} for text, kind, score in suggestions],
+            status=status.HTTP_200_OK,
+        )
+
+
+class ProductLikeAPIView(APIView):
+    def post(self, request, product_id):
+        """ Like a product. The increment is buffered and flushed to the database by a periodic task. """
+        return self._apply(product_id, 1)
+
+    def delete(self, request, product_id):
+        """ Unlike a product. """
+        return self._apply(product_id, -1)
+
+    def _apply(self, product_id, delta):
+        like_count = Product.objects.filter(pk=product_id).values_list('like_count', flat=True).first()
+        if like_count is None:
+            return Response({"error": "Product not found."}, status=status.HTTP_404_NOT_FOUND)
+        if delta < 0 and like_count + pending_like_deltas([product_id]).get(product_id, 0) <= 0:
+            # Nothing left to unlike; buffering it would only cancel out later likes
+            return Response({"product_id": product_id, "like_count": 0}, status=status.HTTP_200_OK)
+        pending = add_product_like(product_id, delta)
+        return Response({"product_id": product_id, "like_count": max(like_count + pending, 0)},
+                        status=status.HTTP_200_OK)
+
+
+class CartQuoteAPIView(APIView):
+    def get(self, request, cart_id):
+        """ Read-only price preview of a cart, served from cache until its items or pricing change. """
+        serializer = CartQuoteSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        cart = Cart.objects.filter(pk=cart_id).select_related('user').first()
+        if not cart:
+            return Response({"error": "Cart not found."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            quote = get_cart_quote(cart, serializer.validated_data['voucher_ids'])
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(quote, status=status.HTTP_200_OK)
+
+
+class OrderHistoryView(ListAPIView):
+    serializer_class = OrderHistorySerializer
+    pagination_class = OrderHistoryPagination
+    permission_classes = [IsAccountOwnerOrSuperUser]
+
+    def get_queryset(self):
+        """ A user's orders with line items and vouchers, in a fixed number of queries per page. """
+        user = get_object_or_404(User, pk=self.kwargs['user_id'])
+        return Order.objects.filter(user=user).select_related('cart').prefetch_related(
+            Prefetch('cart__cartitem_set', queryset=CartItem.objects.select_related('size', 'color')),
+            Prefetch('appliedvoucher_set', queryset=AppliedVoucher.objects.select_related('voucher')),
+        )
+
+
 class OrderCreateAPIView(APIView):
+    @idempotent
     def post(self, request):
         try:
             with transaction.atomic():
@@ -89,87 +224,33 @@ class OrderCreateAPIView(APIView):
 
                 user = User.objects.filter(id=user_id).first()
                 cart = Cart.objects.get(id=cart_id, user=user)
-                cart_items = CartItem.objects.filter(cart=cart)
+                cart_items = CartItem.objects.filter(cart=cart).select_related('size')
 
                 if not cart_items:
                     return Response({"error": "Cart is empty."}, status=status.HTTP_400_BAD_REQUEST)
 
-                total_price = Decimal(0)
-                discounted_product = Decimal(0)
-
+                demand = {}
                 for item in cart_items:
-                    price_obj = Price.objects.filter(size=item.size, color=item.color).order_by("-created_at").first()
-                    if not price_obj:
-                        raise ValueError("Price not found for selected size and color.")
-
-                    price = price_obj.price * item.quantity
-
-                    discount = Discount.objects.filter(
-                        product=item.size.product,
-                        start_at__lte=timezone.now(),
-                        end_at__gte=timezone.now()
-                    ).first()
-
-                    if discount:
-                        product_discount = price * (discount.discount_percent / Decimal(100))
-                        discounted_product += product_discount
-                        price -= product_discount
-
-                    total_price += price
-
-                    stock = Stock.objects.filter(color=item.color, size=item.size).first()
-                    if not stock or stock.quantity < item.quantity:
-                        raise ValueError("Insufficient stock for one or more items.")
+                    variant = (item.size_id, item.color_id)
+                    demand[variant] = demand.get(variant, 0) + item.quantity
+                available = available_quantities(demand.keys())
+                if any(available[variant] < quantity for variant, quantity in demand.items()):
+                    raise ValueError("Insufficient stock for one or more items.")
 
-                # Temporary shipping cost logic
-                shipping_fee = Decimal(5000)
-                discounted_shipping = Decimal(0)
-
-                total_voucher_discount = Decimal(0)
-                voucher = None
-                for voucher_id in voucher_ids:
-                    try:
-                        voucher = Voucher.objects.filter(
-                            id=voucher_id,
-                            start_at__lte=timezone.now(),
-                            end_at__gte=timezone.now()
-                        ).first()
-                    except Exception as e:
-                        raise Exception(e).with_traceback()
-                    if voucher:
-                        # Prevent reuse of previously applied voucher
-                        already_applied = AppliedVoucher.objects.filter(user=user, voucher=voucher).exists()
-                        if already_applied:
-                            return Response(
-                                {"error": f"Voucher ID {voucher_id} has already been used by this user."},
-                                status=status.HTTP_400_BAD_REQUEST
-                            )
-                    if voucher:
-                        if voucher.discount_flat:
-                            discount_amount = min(Decimal(voucher.discount_flat),
-                                                  Decimal(voucher.max_discount or voucher.discount_flat))
-                            total_voucher_discount += discount_amount
-                        elif voucher.discount_percent:
-                            discount_amount = Decimal(total_price) * (Decimal(voucher.discount_percent) / Decimal(100))
-                            discount_amount = min(discount_amount, Decimal(voucher.max_discount))
-                            total_voucher_discount += discount_amount
-                        else:
-                            continue
-                discounted_product += total_voucher_discount
-
-                final_price = total_price + shipping_fee - discounted_product - discounted_shipping - total_voucher_discount
+                quote = price_cart(cart_items, user, voucher_ids)
 
                 order = Order.objects.create(
                     cart=cart,
+                    user=user,
                     payment_method=payment_method,
                     shipping_type=shipping_type,
                     is_company_order=is_company_order,
                     additional_note=additional_note,
-                    total_price=total_price,
-                    shipping_fee=shipping_fee,
-                    discounted_product=discounted_product,
-                    discounted_shipping=discounted_shipping,
-                    final_price=final_price
+                    total_price=quote["total_price"],
+                    shipping_fee=quote["shipping_fee"],
+                    discounted_product=quote["discounted_product"],
+                    discounted_shipping=quote["discounted_shipping"],
+                    final_price=quote["final_price"]
                 )
                 print(f"Order successfully created: {order.id}")
 
@@ -184,16 +265,72 @@ class OrderCreateAPIView(APIView):
                     except Exception as e:
                         print(f"Error while processing voucher {voucher_id}: {e}")
                 print(f"AppliedVoucher successfully created: {order.id}")
-                for item in cart_items:
-                    stock = Stock.objects.get(color=item.color, size=item.size)
-                    stock.quantity -= item.quantity
-                    stock.save()
+                fulfillment = allocate_stock(demand)
                 print(f"Stock successfully modified: {order.id}")
 
-                return Response({"message": "Order created successfully.", "order_id": order.id}, status=status.HTTP_201_CREATED)
-
-        except Exception as e:
+                return Response({
+                    "message": "Order created successfully.",
+                    "order_id": order.id,
+                    "fulfillment": [
+                        {
+                            "store_id": store_id,
+                            "items": [
+                                {"size_id": size_id, "color_id": color_id, "quantity": quantity}
+                                for (size_id, color_id), quantity in shipment.items()
+                            ],
+                        }
+                        for store_id, shipment in fulfillment.items()
+                    ],
+                }, status=status.HTTP_201_CREATED)
+
+        except (ObjectDoesNotExist, ValueError, TypeError, IntegrityError) as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except DatabaseError as e:
+            # Transient (e.g. "database is locked"); a 5xx also releases the Idempotency-Key for the retry
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+class OrderExportAPIView(APIView):
+    permission_classes = [IsSuperUser]
+
+    CONTENT_TYPES = {
+        'csv': 'text/csv',
+        'ndjson': 'application/x-ndjson',
+    }
+
+    def get(self, request):
+        """ Stream orders in `created_at` range as CSV or NDJSON without materializing the result set. """
+        serializer = OrderExportSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        export_format = serializer.validated_data['file_format']
+        response = StreamingHttpResponse(
+            export_orders(
+                export_format,
+                created_at_min=serializer.validated_data.get('created_at_min'),
+                created_at_max=serializer.validated_data.get('created_at_max'),
+            ),
+            content_type=self.CONTENT_TYPES[export_format],
+        )
+        response['Content-Disposition'] = f'attachment; filename="orders.{export_format}"'
+        return response
+
+class SalesAnalyticsAPIView(APIView):
+    permission_classes = [IsSuperUser]
+
+    def get(self, request):
+        """ Revenue and discounts over a date range, answered from the daily sales rollups. """
+        serializer = SalesAnalyticsSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        return Response({
+            "date_from": data['date_from'],
+            "date_to": data['date_to'],
+            "group_by": data.get('group_by'),
+            "up_to_order_id": rollup_watermark(),
+            "results": sales_summary(data['date_from'], data['date_to'], data.get('group_by')),
+        }, status=status.HTTP_200_OK)
 
 class CartCreateAPIView(APIView):
     def post(self, request):